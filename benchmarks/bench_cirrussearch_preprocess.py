@@ -0,0 +1,102 @@
+# Copyright 2022 Masatoshi Suzuki (@singletongue)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import argparse
+import os
+import re
+import sys
+import time
+import unicodedata
+
+from tqdm import tqdm
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from file_io import open_file
+from jsonl_io import make_decoder
+from make_corpus_from_cirrussearch import preprocess_text
+
+
+decode_page_item = make_decoder(("title", "text"))
+
+
+# The implementation before the precompiled patterns, which compiles the navigation pattern for every title
+def preprocess_text_before(text, title=None):
+    text = unicodedata.normalize("NFKC", text)
+
+    # remove invisible characters
+    text = "".join(c for c in text if c.isprintable())
+
+    # remove templates
+    text = re.sub(r"\[\d+?\]", "", text)
+    text = re.sub(r"\[要.+?\]", "", text)
+    text = re.sub(r"\{\{+[^{}]+?\}\}+", "", text)
+
+    # remove navigation
+    if title is not None:
+        text = re.sub(r"^.+? \> " + re.escape(title), "", text)
+
+    # remove footnotes
+    text = re.sub(r" \^ .+", "", text)
+    # remove annotations
+    text = re.sub(r"\[(要出典|リンク切れ|.+?\?)\]", "", text)
+
+    text = re.sub(r"\s+", " ", text).strip()
+    return text
+
+
+def iter_pages(cirrus_file, max_pages=None):
+    # Yields the (title, text) of the page lines, skipping the index lines
+    with open_file(cirrus_file, "rb") as f:
+        for num_pages, (_, page_line) in enumerate(zip(f, f)):
+            if max_pages is not None and num_pages >= max_pages:
+                return
+
+            item = decode_page_item(page_line)
+            yield item["title"], item["text"]
+
+
+def main(args):
+    time_before = 0.0
+    time_after = 0.0
+    num_pages = 0
+    num_chars = 0
+    num_mismatches = 0
+    for title, text in tqdm(iter_pages(args.cirrus_file, args.max_pages), unit="pages"):
+        start_time = time.perf_counter()
+        output_before = preprocess_text_before(text, title=title)
+        time_before += time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        output_after = preprocess_text(text, title=title)
+        time_after += time.perf_counter() - start_time
+
+        num_pages += 1
+        num_chars += len(text)
+        if output_before != output_after:
+            num_mismatches += 1
+
+    print(f"pages: {num_pages}, average length: {num_chars / num_pages:.1f} chars")
+    print(f"before: {num_pages / time_before:10.1f} pages/s, {num_chars / time_before / 1e6:6.2f} M chars/s")
+    print(f" after: {num_pages / time_after:10.1f} pages/s, {num_chars / time_after / 1e6:6.2f} M chars/s")
+    print(f"speedup: {time_before / time_after:.2f}x, pages with different outputs: {num_mismatches}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare preprocess_text() of make_corpus_from_cirrussearch.py with the previous implementation"
+    )
+    parser.add_argument("--cirrus_file", type=str, required=True)
+    parser.add_argument("--max_pages", type=int,
+        help="Number of pages to process. Defaults to all the pages in the dump")
+    args = parser.parse_args()
+    main(args)
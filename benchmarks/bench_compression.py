@@ -0,0 +1,107 @@
+# Copyright 2022 Masatoshi Suzuki (@singletongue)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from file_io import open_file, zstandard
+
+
+# (name, compression, compression level, number of threads) of the codecs,
+# where gzip level 9 in a single thread is the previous default of all the scripts
+CODECS = [
+    ("gzip -9", "gzip", 9, 1),
+    ("gzip -6", "gzip", 6, 1),
+    ("gzip -1", "gzip", 1, 1),
+    ("pigz -6", "gzip", 6, None),
+    ("zstd -3", "zstd", 3, 1),
+    ("zstd -3 (threads)", "zstd", 3, None),
+    ("none", "none", None, 1),
+]
+EXTENSIONS = {"gzip": ".gz", "zstd": ".zst", "none": ""}
+
+
+def read_input(input_file, max_bytes):
+    # The input is decompressed in advance, so that only the codecs are measured
+    with open_file(input_file, "rb") as f:
+        return f.read(max_bytes) if max_bytes is not None else f.read()
+
+
+def benchmark_codec(data, output_file, compression, compression_level, num_threads, chunk_size):
+    start_time = time.perf_counter()
+    with open_file(output_file, "wb", compression=compression, compression_level=compression_level,
+                   num_threads=num_threads) as fo:
+        for i in range(0, len(data), chunk_size):
+            fo.write(data[i:i + chunk_size])
+    write_time = time.perf_counter() - start_time
+    compressed_size = os.path.getsize(output_file)
+
+    start_time = time.perf_counter()
+    num_bytes = 0
+    with open_file(output_file, "rb", num_threads=num_threads) as f:
+        while chunk := f.read(chunk_size):
+            num_bytes += len(chunk)
+    read_time = time.perf_counter() - start_time
+    assert num_bytes == len(data)
+
+    return write_time, read_time, compressed_size
+
+
+def main(args):
+    num_threads = args.num_threads if args.num_threads is not None else os.cpu_count()
+    print(f"threads: {num_threads}, pigz: {shutil.which('pigz') is not None}, zstandard: {zstandard is not None}")
+    print("write and read MB/s are of the uncompressed data")
+
+    for input_file in args.input_files:
+        data = read_input(input_file, args.max_bytes)
+        print(f"\n{os.path.basename(input_file)}: {len(data) / 1e6:.1f} MB uncompressed")
+        print(f"| {'codec':20s} | {'write MB/s':>10s} | {'read MB/s':>10s} | {'ratio':>6s} |")
+        print(f"| {'-' * 20} | {'-' * 10}:| {'-' * 10}:| {'-' * 6}:|")
+        with tempfile.TemporaryDirectory(dir=args.temp_dir) as temp_dir:
+            for name, compression, compression_level, codec_num_threads in CODECS:
+                if name.startswith("pigz") and (shutil.which("pigz") is None or num_threads == 1):
+                    continue
+                if compression == "zstd" and zstandard is None:
+                    continue
+
+                codec_num_threads = codec_num_threads if codec_num_threads is not None else num_threads
+                output_file = os.path.join(temp_dir, "output" + EXTENSIONS[compression])
+                write_time, read_time, compressed_size = benchmark_codec(
+                    data, output_file, compression, compression_level, codec_num_threads, args.chunk_size
+                )
+                os.remove(output_file)
+                print(f"| {name:20s} | {len(data) / write_time / 1e6:10.1f} | {len(data) / read_time / 1e6:10.1f} "
+                      f"| {len(data) / compressed_size:6.2f} |")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the write and read throughput of each codec of file_io.py on the intermediate files"
+    )
+    parser.add_argument("--input_files", type=str, nargs="+", required=True,
+        help="Intermediate files (e.g., the page HTMLs and paragraphs), which are decompressed if compressed")
+    parser.add_argument("--max_bytes", type=int,
+        help="Number of the uncompressed bytes read from each file. Defaults to the whole file")
+    parser.add_argument("--num_threads", type=int,
+        help="Number of threads of pigz and zstd. Defaults to the number of CPUs")
+    parser.add_argument("--chunk_size", type=int, default=64 * 1024,
+        help="Number of bytes written or read at a time")
+    parser.add_argument("--temp_dir", type=str,
+        help="Directory of the temporary compressed files, which should be on the same disk as the outputs")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,99 @@
+# Copyright 2022 Masatoshi Suzuki (@singletongue)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import argparse
+import os
+import statistics
+import sys
+import time
+from itertools import islice
+
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY_DIR)
+from extract_paragraphs_from_page_htmls import (
+    DEFAULT_INNER_TAGS_TO_REMOVE,
+    DEFAULT_TAGS_TO_EXTRACT,
+    DEFAULT_TAGS_TO_REMOVE,
+    HTML_PARSERS,
+)
+from file_io import open_file
+from jsonl_io import iter_jsonl
+
+
+def iter_htmls(args):
+    if args.page_htmls_file is not None:
+        with open_file(args.page_htmls_file, "rb") as f:
+            for item in islice(iter_jsonl(f), args.max_pages):
+                yield item["html"]
+    else:
+        fixture_files = sorted(file_name for file_name in os.listdir(args.fixtures_dir) if file_name.endswith(".html"))
+        for file_name in fixture_files:
+            with open(os.path.join(args.fixtures_dir, file_name)) as f:
+                yield f.read()
+
+
+def time_page(extract_paragraphs, html, num_repeats):
+    # Returns the best time of the repeats to reduce the noise
+    times = []
+    for _ in range(num_repeats):
+        start_time = time.perf_counter()
+        paragraphs = list(
+            extract_paragraphs(html, DEFAULT_TAGS_TO_EXTRACT, DEFAULT_TAGS_TO_REMOVE, DEFAULT_INNER_TAGS_TO_REMOVE)
+        )
+        times.append(time.perf_counter() - start_time)
+
+    return min(times), paragraphs
+
+
+def main(args):
+    page_times = {html_parser: [] for html_parser in HTML_PARSERS}
+    num_mismatched_pages = 0
+    num_pages = 0
+    num_bytes = 0
+    for html in iter_htmls(args):
+        outputs = {}
+        for html_parser, extract_paragraphs in HTML_PARSERS.items():
+            page_time, outputs[html_parser] = time_page(extract_paragraphs, html, args.num_repeats)
+            page_times[html_parser].append(page_time)
+
+        if outputs["lxml"] != outputs["bs4"]:
+            num_mismatched_pages += 1
+
+        num_pages += 1
+        num_bytes += len(html.encode("utf-8"))
+
+    print(f"pages: {num_pages}, average HTML size: {num_bytes / num_pages / 1024:.1f} KiB")
+    for html_parser, times in page_times.items():
+        times = sorted(times)
+        print(
+            f"{html_parser:>5}: mean {statistics.mean(times) * 1000:8.2f} ms/page, "
+            f"median {statistics.median(times) * 1000:8.2f} ms/page, "
+            f"p95 {times[int(0.95 * (len(times) - 1))] * 1000:8.2f} ms/page, "
+            f"{len(times) / sum(times):8.1f} pages/s"
+        )
+
+    speedups = sorted(bs4_time / lxml_time for bs4_time, lxml_time in zip(page_times["bs4"], page_times["lxml"]))
+    print(f"speedup per page: median {statistics.median(speedups):.2f}x, "
+          f"min {speedups[0]:.2f}x, max {speedups[-1]:.2f}x")
+    print(f"pages with different paragraphs: {num_mismatched_pages}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the per-page time of the bs4 and lxml extraction engines")
+    parser.add_argument("--page_htmls_file", type=str,
+        help="Page HTMLs file generated by get_page_htmls.py. Defaults to the pages in --fixtures_dir")
+    parser.add_argument("--fixtures_dir", type=str, default=os.path.join(REPOSITORY_DIR, "tests", "fixtures"))
+    parser.add_argument("--max_pages", type=int, default=1000)
+    parser.add_argument("--num_repeats", type=int, default=5)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,142 @@
+# Copyright 2022 Masatoshi Suzuki (@singletongue)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import argparse
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from get_page_htmls import fetch_page_htmls
+
+
+def make_latency_function(latency, slow_latency, slow_fraction):
+    # The latency of a page is determined by its page id, so that both fetchers see the same latencies
+    def get_latency(pageid):
+        rng = random.Random(pageid)
+        if rng.random() < slow_fraction:
+            return slow_latency
+        else:
+            return latency * rng.uniform(0.5, 1.5)
+
+    return get_latency
+
+
+def start_mock_server(port, get_latency, page_size):
+    # Serves /page/html/<title>/<revid> like the REST API, in a separate thread with its own event loop
+    html = "<html><body><section><p>{}</p></section></body></html>".format("あ" * (page_size // 3))
+
+    async def handle_page(request):
+        await asyncio.sleep(get_latency(int(request.match_info["title"])))
+        return web.Response(text=html, content_type="text/html")
+
+    app = web.Application()
+    app.router.add_get("/page/html/{title}/{revid}", handle_page)
+    runner = web.AppRunner(app, access_log=None)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", port).start())
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+
+def make_page_items(base_url, num_pages):
+    return [
+        {"title": str(pageid), "pageid": pageid, "revid": pageid, "url": f"{base_url}/page/html/{pageid}/{pageid}"}
+        for pageid in range(num_pages)
+    ]
+
+
+def run_batch_and_sleep(page_items, args):
+    # The fetch loop before the asyncio fetcher: each batch waits for its slowest response,
+    # and then sleeps for batch_size / 200 seconds
+    def fetch(page_item):
+        response = requests.get(page_item["url"], timeout=args.timeout)
+        response.raise_for_status()
+        return response.text
+
+    with ThreadPoolExecutor(args.max_concurrent_requests) as executor:
+        for i in range(0, len(page_items), args.max_concurrent_requests):
+            batch_page_items = page_items[i:i + args.max_concurrent_requests]
+            for page_item, html in zip(batch_page_items, executor.map(fetch, batch_page_items)):
+                page_item["html"] = html
+
+            time.sleep(args.max_concurrent_requests / 200)
+
+
+class CountingWriter(object):
+    def __init__(self):
+        self.num_items = 0
+
+    def write(self, item):
+        self.num_items += 1
+
+
+def run_asyncio_fetcher(page_items, args):
+    fetch_args = argparse.Namespace(
+        user_agent="bench_get_page_htmls",
+        timeout=args.timeout,
+        max_concurrent_requests=args.max_concurrent_requests,
+        max_requests_per_second=args.max_requests_per_second,
+        adaptive_concurrency=False,
+    )
+    writer = CountingWriter()
+    failed_pages = []
+    with open(os.devnull, "w") as failed_pages_journal:
+        asyncio.run(fetch_page_htmls(iter(page_items), writer, failed_pages, failed_pages_journal, fetch_args))
+
+    if writer.num_items != len(page_items):
+        raise RuntimeError(f"{len(failed_pages)} requests failed")
+
+
+def main(args):
+    get_latency = make_latency_function(args.latency, args.slow_latency, args.slow_fraction)
+    start_mock_server(args.port, get_latency, args.page_size)
+    base_url = f"http://127.0.0.1:{args.port}"
+
+    print(f"pages: {args.num_pages}, concurrency: {args.max_concurrent_requests}, "
+          f"latency: {args.latency}s, slow pages: {args.slow_fraction:.1%} x {args.slow_latency}s")
+    for name, run in [("batch-and-sleep", run_batch_and_sleep), ("asyncio", run_asyncio_fetcher)]:
+        page_items = make_page_items(base_url, args.num_pages)
+        start_time = time.perf_counter()
+        run(page_items, args)
+        elapsed_time = time.perf_counter() - start_time
+        print(f"{name:>16}: {args.num_pages / elapsed_time:8.1f} req/s ({elapsed_time:.2f}s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the sustained req/s of the asyncio fetcher and the batch-and-sleep loop "
+                    "against a local mock REST server"
+    )
+    parser.add_argument("--num_pages", type=int, default=1000)
+    parser.add_argument("--max_concurrent_requests", type=int, default=20)
+    parser.add_argument("--max_requests_per_second", type=float, default=200)
+    parser.add_argument("--latency", type=float, default=0.05,
+        help="Median latency of the mock server in seconds")
+    parser.add_argument("--slow_latency", type=float, default=1.0,
+        help="Latency of the slow pages in seconds")
+    parser.add_argument("--slow_fraction", type=float, default=0.02,
+        help="Fraction of the pages responded with --slow_latency")
+    parser.add_argument("--page_size", type=int, default=50000,
+        help="Size of the HTML of each page in bytes")
+    parser.add_argument("--timeout", type=int, default=60)
+    parser.add_argument("--port", type=int, default=18080)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,202 @@
+# Copyright 2022 Masatoshi Suzuki (@singletongue)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import argparse
+import io
+import json
+import os
+import sys
+import time
+from itertools import islice
+
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY_DIR)
+import jsonl_io
+from bench_text_normalization import SAMPLE_PARAGRAPHS
+from file_io import open_file
+from jsonl_io import loads, make_decoder, write_jsonl
+from make_corpus_from_cirrussearch import decode_page_item
+from make_passages_from_paragraphs import PARAGRAPH_COLUMNS
+from parquet_io import PASSAGE_FIELDS, is_parquet_file
+
+
+# The fields decoded by the stages reading the files, or None for the stages decoding the whole lines
+STAGE_FIELDS = {
+    # extract_paragraphs_from_page_htmls.py
+    "page_htmls": None,
+    # make_passages_from_paragraphs.py
+    "paragraphs": PARAGRAPH_COLUMNS,
+    # build_es_index_passages.py
+    "passages": tuple(PASSAGE_FIELDS),
+    # page_metadata.py
+    "page_ids": None,
+    # make_corpus_from_cirrussearch.py
+    "cirrussearch": ("title", "text", "template", "incoming_links"),
+}
+
+
+def make_sample_items(stage, fixtures_dir, num_items):
+    # Items in the format of each stage, used when no file is given for the stage
+    if stage == "page_htmls":
+        htmls = []
+        for file_name in sorted(os.listdir(fixtures_dir)):
+            if file_name.endswith(".html"):
+                with open(os.path.join(fixtures_dir, file_name)) as f:
+                    htmls.append(f.read())
+
+        return [
+            {"title": f"ページ{i}", "pageid": i, "revid": i + 1000, "url": f"https://example.org/{i}",
+             "html": htmls[i % len(htmls)]}
+            for i in range(num_items)
+        ]
+    elif stage == "paragraphs":
+        return [
+            {"id": f"{i}-{i + 1000}-0", "pageid": i, "revid": i + 1000, "paragraph_index": 0, "title": f"ページ{i}",
+             "section": "__LEAD__", "text": SAMPLE_PARAGRAPHS[i % len(SAMPLE_PARAGRAPHS)], "html_tag": "p"}
+            for i in range(num_items)
+        ]
+    elif stage == "passages":
+        return [
+            {"id": i, "pageid": i, "revid": i + 1000, "title": f"ページ{i}", "section": "__LEAD__",
+             "text": "".join(SAMPLE_PARAGRAPHS[i % len(SAMPLE_PARAGRAPHS):][:2])}
+            for i in range(num_items)
+        ]
+    elif stage == "page_ids":
+        return [
+            {"title": f"ページ{i}", "pageid": i, "revid": i + 1000, "num_inlinks": i % 100,
+             "is_disambiguation_page": i % 50 == 0, "is_sexual_page": False, "is_violent_page": False}
+            for i in range(num_items)
+        ]
+    else:
+        return None
+
+
+def load_lines(file, max_lines, is_cirrussearch=False):
+    with open_file(file, "rb") as f:
+        if is_cirrussearch:
+            # only the page lines, skipping the index lines
+            return [page_line for _, page_line in islice(zip(f, f), max_lines)]
+
+        return list(islice(f, max_lines))
+
+
+def time_function(function, num_repeats):
+    # Returns the fastest time of the repeats, and the output of the function
+    times = []
+    for _ in range(num_repeats):
+        start_time = time.perf_counter()
+        output = function()
+        times.append(time.perf_counter() - start_time)
+
+    return min(times), output
+
+
+def print_throughput(name, elapsed_time, num_lines, num_bytes):
+    print(f"  {name:24s}: {num_bytes / elapsed_time / 1e6:8.1f} MB/s, {num_lines / elapsed_time:10.1f} lines/s")
+
+
+def encode_before(items):
+    # The previous implementation writing one line per print()
+    fo = io.StringIO()
+    for item in items:
+        print(json.dumps(item, ensure_ascii=False), file=fo)
+
+    return fo.getvalue()
+
+
+def encode_after(items):
+    fo = io.StringIO()
+    write_jsonl(fo, items)
+    return fo.getvalue()
+
+
+def benchmark_stage(stage, lines, num_repeats):
+    fields = STAGE_FIELDS[stage]
+    num_lines = len(lines)
+    num_bytes = sum(len(line) for line in lines)
+    print(f"{stage}: {num_lines} lines, {num_bytes / num_lines:.0f} bytes/line")
+
+    decode_time_before, items = time_function(lambda: [json.loads(line) for line in lines], num_repeats)
+    print_throughput("decode (json)", decode_time_before, num_lines, num_bytes)
+    decode_time_after, _ = time_function(lambda: [loads(line) for line in lines], num_repeats)
+    print_throughput("decode (jsonl_io)", decode_time_after, num_lines, num_bytes)
+    if fields is not None:
+        decode = decode_page_item if stage == "cirrussearch" else make_decoder(fields)
+        decode_time_fields, _ = time_function(lambda: [decode(line) for line in lines], num_repeats)
+        print_throughput(f"decode ({len(fields)} fields)", decode_time_fields, num_lines, num_bytes)
+        # the stage uses the field decoder
+        decode_time_after = decode_time_fields
+
+    print(f"  decode speedup: {decode_time_before / decode_time_after:.2f}x")
+
+    # The outputs are encoded from the decoded items, which are the same in both implementations
+    encode_time_before, output_before = time_function(lambda: encode_before(items), num_repeats)
+    print_throughput("encode (json + print)", encode_time_before, num_lines, num_bytes)
+    encode_time_after, output_after = time_function(lambda: encode_after(items), num_repeats)
+    print_throughput("encode (write_jsonl)", encode_time_after, num_lines, num_bytes)
+    print(f"  encode speedup: {encode_time_before / encode_time_after:.2f}x, "
+          f"same output: {output_before == output_after}")
+
+
+def main(args):
+    if jsonl_io.orjson is not None:
+        fast_codec = "orjson"
+    elif jsonl_io.msgspec is not None:
+        fast_codec = "msgspec"
+    else:
+        fast_codec = "none"
+
+    print(f"fast decoder: {fast_codec}, field decoding with msgspec: {jsonl_io.msgspec is not None}")
+
+    stage_files = {
+        "page_htmls": args.page_htmls_file,
+        "paragraphs": args.paragraphs_file,
+        "passages": args.passages_file,
+        "page_ids": args.page_ids_file,
+        "cirrussearch": args.cirrus_file,
+    }
+    for stage, file in stage_files.items():
+        if file is not None:
+            if is_parquet_file(file):
+                print(f"{stage}: skipped, since {file} is a Parquet file")
+                continue
+
+            lines = load_lines(file, args.max_lines, is_cirrussearch=stage == "cirrussearch")
+        else:
+            sample_items = make_sample_items(stage, args.fixtures_dir, args.max_lines)
+            if sample_items is None:
+                continue
+
+            lines = [json.dumps(item, ensure_ascii=False).encode("utf-8") + b"\n" for item in sample_items]
+
+        benchmark_stage(stage, lines, args.num_repeats)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the decoding and encoding throughput of the JSON Lines files of each stage, "
+                    "comparing jsonl_io.py with the standard library"
+    )
+    parser.add_argument("--page_htmls_file", type=str)
+    parser.add_argument("--paragraphs_file", type=str)
+    parser.add_argument("--passages_file", type=str)
+    parser.add_argument("--page_ids_file", type=str)
+    parser.add_argument("--cirrus_file", type=str,
+        help="CirrusSearch dump, which is benchmarked only if given")
+    parser.add_argument("--fixtures_dir", type=str, default=os.path.join(REPOSITORY_DIR, "tests", "fixtures"),
+        help="Directory of the HTML files used for the page HTMLs if --page_htmls_file is not given")
+    parser.add_argument("--max_lines", type=int, default=10000,
+        help="Number of lines read from each file, or generated for each stage without a file")
+    parser.add_argument("--num_repeats", type=int, default=3)
+    args = parser.parse_args()
+    main(args)
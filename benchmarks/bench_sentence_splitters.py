@@ -0,0 +1,151 @@
+# Copyright 2022 Masatoshi Suzuki (@singletongue)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import argparse
+import os
+import random
+import sys
+import time
+from itertools import islice
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bench_text_normalization import SAMPLE_PARAGRAPHS
+from file_io import open_file
+from jsonl_io import iter_jsonl
+from sentence_splitters import MeCabSentenceSplitter, RuleBasedSentenceSplitter, create_mecab_tagger
+
+
+class MeCabSentenceSplitterBefore(object):
+    # The implementation before iterating the nodes, which parses the formatted output of MeCab
+    def __init__(self, mecab_option=None):
+        self.mecab = create_mecab_tagger(mecab_option)
+
+    def __call__(self, text):
+        sentences = []
+        start = 0
+        end = 0
+        for line in self.mecab.parse(text).split("\n"):
+            if line == "EOS":
+                if len(text[start:]) > 0:
+                    sentences.append(text[start:])
+                break
+
+            token, token_info = line.split("\t", maxsplit=1)
+            end = text.index(token, end) + len(token)
+            if "記号" in token_info and "句点" in token_info:
+                sentences.append(text[start:end])
+                start = end
+
+        return sentences
+
+    def split_many(self, texts):
+        return [self(text) for text in texts]
+
+
+# Words, punctuation marks and symbols of the random texts, in which the punctuation marks are often next to symbols
+# as in titles like "モーニング娘。'14" or "遊戯王!-ゼアル-"
+RANDOM_TEXT_WORDS = ["東京", "モーニング娘", "遊戯王", "ゼアル", "放送", "の", "は", "メンバー", "14", "2014年", "abc", "です"]
+RANDOM_TEXT_MARKS = list("。！？!?")
+RANDOM_TEXT_SYMBOLS = list("'-;・:/~～+*#&%$@=_|^<>\"“”「」（）()、，,…‥ー♪★☆→※々〆〇 　")
+
+
+def make_random_texts(num_texts, seed=0):
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(num_texts):
+        parts = []
+        for _ in range(rng.randint(2, 10)):
+            r = rng.random()
+            if r < 0.5:
+                parts.append(rng.choice(RANDOM_TEXT_WORDS))
+            elif r < 0.75:
+                parts.append(rng.choice(RANDOM_TEXT_MARKS))
+            else:
+                parts.append(rng.choice(RANDOM_TEXT_SYMBOLS))
+
+        texts.append("".join(parts))
+
+    return texts
+
+
+def load_texts(args):
+    if args.paragraphs_file is None:
+        return SAMPLE_PARAGRAPHS * (args.max_paragraphs // len(SAMPLE_PARAGRAPHS))
+
+    with open_file(args.paragraphs_file, "rb") as f:
+        return [item["text"] for item in islice(iter_jsonl(f), args.max_paragraphs)]
+
+
+def time_splitter(sentence_splitter, texts, num_repeats):
+    times = []
+    for _ in range(num_repeats):
+        start_time = time.perf_counter()
+        sentences_list = sentence_splitter.split_many(texts)
+        times.append(time.perf_counter() - start_time)
+
+    return min(times), sentences_list
+
+
+def compare_splitters(name, reference_splitter, sentence_splitter, texts, num_repeats):
+    reference_time, reference_sentences_list = time_splitter(reference_splitter, texts, num_repeats)
+    splitter_time, sentences_list = time_splitter(sentence_splitter, texts, num_repeats)
+    num_sentences = sum(len(sentences) for sentences in reference_sentences_list)
+    num_agreements = sum(
+        sentences == reference_sentences
+        for sentences, reference_sentences in zip(sentences_list, reference_sentences_list)
+    )
+    print(
+        f"{name}: {num_sentences / reference_time:10.0f} -> {num_sentences / splitter_time:10.0f} sentences/s, "
+        f"speedup {reference_time / splitter_time:.2f}x, "
+        f"agreement {num_agreements}/{len(texts)} ({num_agreements / len(texts):.2%})"
+    )
+
+
+def main(args):
+    texts = load_texts(args)
+    print(f"paragraphs: {len(texts)}, average length: {sum(len(text) for text in texts) / len(texts):.1f} chars")
+
+    mecab_sentence_splitter = MeCabSentenceSplitter(args.mecab_option)
+    rule_based_sentence_splitter = RuleBasedSentenceSplitter(args.mecab_option)
+    compare_splitters(
+        "mecab (before -> after)",
+        MeCabSentenceSplitterBefore(args.mecab_option),
+        mecab_sentence_splitter,
+        texts,
+        args.num_repeats,
+    )
+
+    random_texts = make_random_texts(args.num_random_texts)
+    for name, texts in [("paragraphs", texts), ("random texts", random_texts)]:
+        num_rule_based_texts = sum(rule_based_sentence_splitter.split_by_rules(text) is not None for text in texts)
+        print(f"{name}: {num_rule_based_texts / len(texts):.2%} of the texts are split by the rules")
+        compare_splitters(
+            f"{name} (mecab -> rule_based)",
+            mecab_sentence_splitter,
+            rule_based_sentence_splitter,
+            texts,
+            args.num_repeats,
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the sentences/s and the outputs of the sentence splitters")
+    parser.add_argument("--paragraphs_file", type=str,
+        help="Paragraphs file generated by extract_paragraphs_from_page_htmls.py. Defaults to the sample paragraphs")
+    parser.add_argument("--max_paragraphs", type=int, default=20000)
+    parser.add_argument("--num_random_texts", type=int, default=10000,
+        help="Number of the random texts with punctuation marks next to symbols")
+    parser.add_argument("--num_repeats", type=int, default=3)
+    parser.add_argument("--mecab_option", type=str)
+    args = parser.parse_args()
+    main(args)
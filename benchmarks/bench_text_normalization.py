@@ -0,0 +1,115 @@
+# Copyright 2022 Masatoshi Suzuki (@singletongue)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import argparse
+import os
+import re
+import sys
+import time
+import unicodedata
+from itertools import islice
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from file_io import open_file
+from jsonl_io import iter_jsonl
+from text_normalization import normalize_corpus_text, normalize_paragraph_text
+
+
+# Paragraphs in the style of Japanese Wikipedia, including full-width alphanumerics, half-width katakana,
+# no-break spaces, zero-width characters and line breaks, used when no paragraphs file is given
+SAMPLE_PARAGRAPHS = [
+    "東京都（とうきょうと、英語: Tokyo Metropolis）は、日本の首都機能が置かれている都道府県である。"
+    "人口は約１４００万人で、区部と多摩地域、島嶼部からなる。",
+    "富士山（ふじさん）は、静岡県と山梨県にまたがる活火山である。標高3776.12 m、日本の最高峰である。",
+    "ＰｙｔｈｏｎはGuido van Rossumによって開発されたプログラミング言語であり、"
+    "１９９１年に最初のバージョンが公開された。ﾊﾟｲｿﾝと呼ばれることもある。",
+    "1943年（昭和18年）に東京府と東京市が統合されて東京都が成立した​。\n"
+    "戦後は２３の特別区が置かれ、現在に至る。",
+    "アンパサンド（&）は、英語の\"and\"を意味する記号である。ラテン語の\"et\"の合字に由来し、"
+    "「＆」と全角で書かれることもある　（例: Ｒ＆Ｂ）。",
+    "ピタゴラスの定理は、直角三角形の斜辺の長さをc、他の2辺の長さをa、bとすると、"
+    "a² + b² = c² が成り立つという定理である⁠。三平方の定理とも呼ばれる。",
+    "モーニング娘。'14は、2014年に活動したモーニング娘。の名義である。\t"
+    "メンバーは全部で１０名で、シングル「笑顔の君は太陽さ」などを発表した。",
+    "平成３０年７月豪雨では、西日本を中心に広い範囲で記録的な大雨となり、"
+    "死者は２００人を超えた﻿。気象庁は１１府県に大雨特別警報を発表した。",
+]
+
+
+# The implementations before the shared normalization module
+def normalize_text_before(text):
+    text = unicodedata.normalize("NFKC", text)
+    text = " ".join(text.split())
+    text = "".join(char for char in text if char.isprintable())
+    text = text.strip()
+    return text
+
+
+def preprocess_text_before(text):
+    text = unicodedata.normalize("NFKC", text)
+
+    text = "".join(c for c in text if c.isprintable())
+    text = re.sub(r"\s+", " ", text).strip()
+    return text
+
+
+def load_texts(args):
+    if args.paragraphs_file is None:
+        return SAMPLE_PARAGRAPHS * (args.max_paragraphs // len(SAMPLE_PARAGRAPHS))
+
+    # The paragraphs in the file are already normalized, so they are made NFKD again,
+    # in the same way as the texts in the HTMLs which are not always in the NFKC form
+    with open_file(args.paragraphs_file, "rb") as f:
+        return [unicodedata.normalize("NFKD", item["text"]) for item in islice(iter_jsonl(f), args.max_paragraphs)]
+
+
+def time_function(function, texts, num_repeats):
+    times = []
+    for _ in range(num_repeats):
+        start_time = time.perf_counter()
+        outputs = [function(text) for text in texts]
+        times.append(time.perf_counter() - start_time)
+
+    return min(times), outputs
+
+
+def main(args):
+    texts = load_texts(args)
+    num_chars = sum(len(text) for text in texts)
+    print(f"paragraphs: {len(texts)}, average length: {num_chars / len(texts):.1f} chars")
+
+    comparisons = [
+        ("paragraph text", normalize_text_before, normalize_paragraph_text),
+        ("corpus text", preprocess_text_before, normalize_corpus_text),
+    ]
+    for name, function_before, function_after in comparisons:
+        time_before, outputs_before = time_function(function_before, texts, args.num_repeats)
+        time_after, outputs_after = time_function(function_after, texts, args.num_repeats)
+        num_mismatches = sum(before != after for before, after in zip(outputs_before, outputs_after))
+        print(
+            f"{name:>14}: before {len(texts) / time_before:10.0f} paragraphs/s, "
+            f"after {len(texts) / time_after:10.0f} paragraphs/s, "
+            f"speedup {time_before / time_after:.2f}x, different outputs: {num_mismatches}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the text normalization with the implementations before the shared module"
+    )
+    parser.add_argument("--paragraphs_file", type=str,
+        help="Paragraphs file generated by extract_paragraphs_from_page_htmls.py. Defaults to the sample paragraphs")
+    parser.add_argument("--max_paragraphs", type=int, default=100000)
+    parser.add_argument("--num_repeats", type=int, default=3)
+    args = parser.parse_args()
+    main(args)
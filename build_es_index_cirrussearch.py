@@ -12,30 +12,113 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import argparse
-import gzip
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 
-import requests
 from elasticsearch import Elasticsearch
 from logzero import logger
 from tqdm import tqdm
 
+from es_utils import (
+    fetch_cirrus_settings_snapshot,
+    ingest_settings,
+    load_cirrus_settings_snapshot,
+    managed_rebuild,
+    save_cirrus_settings_snapshot,
+)
+from file_io import open_file
+from jsonl_io import loads
 
-def main(args):
-    es = Elasticsearch(hosts=[{"host": args.hostname, "port": args.port}], timeout=60)
+
+def iter_bulk_lines(cirrus_file, max_lines, max_bytes):
+    # The dump file consists of pairs of an action line and a document line, which are not split across requests.
+    # A request is made as large as possible within both max_lines and max_bytes, but has at least one pair.
+    with open_file(cirrus_file, "rb") as f:
+        bulk_lines = []
+        num_bytes = 0
+        for action_line in f:
+            document_line = next(f, None)
+            if document_line is None:
+                raise ValueError("The dump ends with an action line without a document line. It may be truncated.")
+
+            pair_bytes = len(action_line) + len(document_line)
+            if len(bulk_lines) > 0 and (len(bulk_lines) + 2 > max_lines or num_bytes + pair_bytes > max_bytes):
+                yield bulk_lines
+                bulk_lines = []
+                num_bytes = 0
+
+            bulk_lines += [action_line, document_line]
+            num_bytes += pair_bytes
+
+        if len(bulk_lines) > 0:
+            yield bulk_lines
+
+
+def send_bulk_request(es, index_name, bulk_lines, max_retries, initial_backoff=2, max_backoff=600):
+    # Sends a bulk request and retries the documents rejected with 429 (Too Many Requests) with exponential backoff.
+    # Returns the number of the documents and bytes, and the counts of the errors by their types.
+    num_docs = len(bulk_lines) // 2
+    num_bytes = sum(len(line) for line in bulk_lines)
+    error_counts = Counter()
+    for num_retries in range(max_retries + 1):
+        response = es.bulk(body=b"".join(bulk_lines), index=index_name)
+        if not response["errors"]:
+            break
+
+        rejected_lines = []
+        for i, item in enumerate(response["items"]):
+            item = next(iter(item.values()))
+            status = item.get("status", 500)
+            if status == 429 and num_retries < max_retries:
+                rejected_lines += bulk_lines[2 * i:2 * i + 2]
+            elif status >= 300:
+                error_counts[item.get("error", {}).get("type", str(status))] += 1
+
+        if len(rejected_lines) == 0:
+            break
+
+        time.sleep(min(initial_backoff * 2 ** num_retries, max_backoff))
+        bulk_lines = rejected_lines
+
+    return num_docs, num_bytes, error_counts
+
+
+def validate_settings_snapshot(snapshot, cirrus_file, num_docs):
+    # Checks that the fields of the first documents in the dump file are in the mappings of the snapshot,
+    # since the fields not in the mappings are not indexed
+    properties = snapshot["mappings"]["content"].get("properties", {})
+    unknown_fields = Counter()
+    with open_file(cirrus_file, "rt") as f:
+        for _, (action_line, document_line) in zip(range(num_docs), zip(f, f)):
+            assert "index" in loads(action_line)
+            unknown_fields.update(field for field in loads(document_line) if field not in properties)
+
+    if len(unknown_fields) > 0:
+        logger.warning("Fields not in the mappings of the snapshot: %s", dict(unknown_fields))
+    else:
+        logger.info("All the fields of the first %d documents are in the mappings of the snapshot", num_docs)
+
+
+def build_index(es, index_name, args, optimize_for_ingest=False):
+    if args.settings_snapshot_file is not None:
+        logger.info("Loading the settings and mappings from %s", args.settings_snapshot_file)
+        snapshot = load_cirrus_settings_snapshot(args.settings_snapshot_file, language=args.language)
+        validate_settings_snapshot(snapshot, args.cirrus_file, args.num_docs_to_validate)
+    else:
+        logger.info("Fetching the settings and mappings")
+        snapshot = fetch_cirrus_settings_snapshot(args.language)
+        if args.save_settings_snapshot_dir is not None:
+            snapshot_file = save_cirrus_settings_snapshot(snapshot, args.save_settings_snapshot_dir)
+            logger.info("Saved the settings and mappings to %s", snapshot_file)
+
+    settings = snapshot["settings"]
+    mappings = snapshot["mappings"]
 
     logger.info("Creating an Elasticsearch index")
-    # https://www.elastic.co/jp/blog/loading-wikipedia
-    wiki_endpoint = f"https://{args.language}.wikipedia.org/w/api.php"
-    settings = requests.get(
-        wiki_endpoint,
-        {"action": "cirrus-settings-dump", "format": "json", "formatversion": 2}
-    ).json()
-    mappings = requests.get(
-        wiki_endpoint,
-        {"action": "cirrus-mapping-dump", "format": "json", "formatversion": 2}
-    ).json()
     es.indices.create(
-        index=args.index_name,
+        index=index_name,
         body={
             "settings": {
                 "index": {
@@ -50,15 +133,53 @@ def main(args):
 
     logger.info("Indexing documents")
     assert args.bulk_size % 2 == 0, "The bulk_size should be a multiple of 2."
-    with gzip.open(args.cirrus_file, "rt") as f:
-        bulk_lines = []
-        for line in tqdm(f):
-            bulk_lines.append(line)
-            if len(bulk_lines) == args.bulk_size:
-                es.bulk(body="".join(bulk_lines), index=args.index_name)
-                bulk_lines.clear()
-        else:
-            es.bulk(body="".join(bulk_lines), index=args.index_name)
+    ingest_context = ingest_settings(es, index_name) if optimize_for_ingest else nullcontext()
+    error_counts = Counter()
+    num_bytes = 0
+    start_time = time.time()
+
+    def update_progress(result):
+        nonlocal num_bytes
+        num_docs, num_request_bytes, request_error_counts = result
+        error_counts.update(request_error_counts)
+        num_bytes += num_request_bytes
+        pbar.update(num_docs)
+        pbar.set_postfix(MB_per_sec="{:.2f}".format(num_bytes / 1024 ** 2 / (time.time() - start_time)))
+
+    # The dump file is decompressed and split into bulk requests in the main thread,
+    # while the requests are sent by multiple threads.
+    # The number of requests in flight is bounded so that the dump file is not read faster than it is indexed.
+    with ingest_context, tqdm(unit="docs") as pbar, ThreadPoolExecutor(args.num_bulk_threads) as executor:
+        pending_results = deque()
+        for bulk_lines in iter_bulk_lines(args.cirrus_file, args.bulk_size, args.bulk_max_bytes):
+            pending_results.append(
+                executor.submit(send_bulk_request, es, index_name, bulk_lines, args.bulk_max_retries)
+            )
+            if len(pending_results) >= args.num_bulk_threads * 2:
+                update_progress(pending_results.popleft().result())
+
+        while pending_results:
+            update_progress(pending_results.popleft().result())
+
+    if len(error_counts) > 0:
+        logger.warning("Failed to index %d documents: %s", sum(error_counts.values()), dict(error_counts))
+
+
+def main(args):
+    # The connection pool is as large as the number of threads sending bulk requests
+    es = Elasticsearch(hosts=[{"host": args.hostname, "port": args.port}], timeout=60, maxsize=args.num_bulk_threads)
+
+    if args.rebuild_with_alias:
+        with managed_rebuild(
+            es,
+            args.index_name,
+            health_status=args.wait_for_status,
+            warm_up_queries_file=args.warm_up_queries_file,
+            num_indices_to_keep=args.num_indices_to_keep,
+        ) as index_name:
+            build_index(es, index_name, args, optimize_for_ingest=True)
+    else:
+        build_index(es, args.index_name, args)
 
 
 if __name__ == "__main__":
@@ -68,6 +189,30 @@ if __name__ == "__main__":
     parser.add_argument("--language", type=str, required=True)
     parser.add_argument("--hostname", type=str, default="localhost")
     parser.add_argument("--port", type=int, default=9200)
-    parser.add_argument("--bulk_size", type=int, default=200)
+    parser.add_argument("--settings_snapshot_file", type=str,
+        help="Snapshot of the settings and mappings saved by get_cirrussearch_settings.py or "
+             "--save_settings_snapshot_dir, used instead of fetching them from the Wikipedia API")
+    parser.add_argument("--save_settings_snapshot_dir", type=str,
+        help="Save the settings and mappings fetched from the Wikipedia API to this directory")
+    parser.add_argument("--num_docs_to_validate", type=int, default=1000,
+        help="Number of documents checked against the mappings of --settings_snapshot_file")
+    parser.add_argument("--bulk_size", type=int, default=200,
+        help="Maximum number of lines (a pair of an action line and a document line per page) in a bulk request")
+    parser.add_argument("--bulk_max_bytes", type=int, default=10 * 1024 * 1024,
+        help="Maximum size of a bulk request in bytes")
+    parser.add_argument("--num_bulk_threads", type=int, default=4,
+        help="Number of threads sending bulk requests concurrently")
+    parser.add_argument("--bulk_max_retries", type=int, default=5,
+        help="Maximum number of retries of the documents rejected with 429 (Too Many Requests)")
+    parser.add_argument("--rebuild_with_alias", action="store_true",
+        help="Build a new index named --index_name with a timestamp suffix with replicas disabled during indexing, "
+             "and move the alias --index_name to it once it is ready")
+    parser.add_argument("--wait_for_status", choices=("green", "yellow"), default="green",
+        help="Health status of the new index to wait for before moving the alias. "
+             "Use yellow for a single-node cluster, where replicas are never assigned")
+    parser.add_argument("--warm_up_queries_file", type=str,
+        help="File of search request bodies (one JSON per line) run on the new index before moving the alias")
+    parser.add_argument("--num_indices_to_keep", type=int, default=2,
+        help="Number of the latest versions of the index to keep, including the new one")
     args = parser.parse_args()
     main(args)
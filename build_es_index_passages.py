@@ -12,13 +12,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import argparse
-import gzip
-import json
+from contextlib import nullcontext
 
 from elasticsearch import Elasticsearch
-from elasticsearch.helpers import bulk
 from logzero import logger
-from tqdm import tqdm
+from tqdm import tqdm, trange
+
+from es_utils import ingest_settings, managed_rebuild, parallel_streaming_bulk
+from jsonl_io import dumps, loads
+from page_metadata import load_page_metadata
+from parquet_io import PASSAGE_FIELDS, iter_items
 
 
 ES_SETTINGS = {
@@ -62,51 +65,134 @@ ES_MAPPINGS = {
 }
 
 
-def main(args):
-    es = Elasticsearch(hosts=[{"host": args.hostname, "port": args.port}], timeout=60)
+def build_index(es, index_name, args, optimize_for_ingest=False):
+    if args.update_index:
+        logger.info("Updating the existing Elasticsearch index")
+    else:
+        logger.info("Creating an Elasticsearch index")
+        es.indices.create(index=index_name, settings=ES_SETTINGS, mappings=ES_MAPPINGS)
+
+    if args.delete_page_ids_files is not None:
+        logger.info("Deleting the documents of the updated/deleted pages")
+        page_ids_to_delete = set()
+        for page_ids_file in args.delete_page_ids_files:
+            with open(page_ids_file) as f:
+                page_ids_to_delete.update(loads(line)["pageid"] for line in tqdm(f))
 
-    logger.info("Creating an Elasticsearch index")
-    es.indices.create(index=args.index_name, settings=ES_SETTINGS, mappings=ES_MAPPINGS)
+        page_ids_to_delete = sorted(page_ids_to_delete)
+        num_deleted = 0
+        for i in trange(0, len(page_ids_to_delete), args.delete_batch_size):
+            response = es.delete_by_query(
+                index=index_name,
+                body={"query": {"terms": {"pageid": page_ids_to_delete[i:i + args.delete_batch_size]}}},
+                conflicts="proceed",
+            )
+            num_deleted += response["deleted"]
+
+        logger.info("Deleted %d documents of %d pages", num_deleted, len(page_ids_to_delete))
 
     logger.info("Loading page ids file")
-    page_info = dict()
-    with open(args.page_ids_file) as f:
-        for line in tqdm(f):
-            pageid_item = json.loads(line)
-            pageid = pageid_item.pop("pageid")
-            page_info[pageid] = pageid_item
+    page_info = load_page_metadata(args.page_ids_file)
 
     logger.info("Indexing documents")
     def generate_bulk_actions():
-        with gzip.open(args.passages_file) as f:
-            for line in tqdm(f):
-                passage_item = json.loads(line)
-                pageid = passage_item["pageid"]
-                yield {
-                    "_index": args.index_name,
-                    "_source": {
-                        "id": passage_item["id"],
-                        "pageid": passage_item["pageid"],
-                        "revid": passage_item["revid"],
-                        "title": passage_item["title"],
-                        "section": passage_item["section"],
-                        "text": passage_item["text"],
-                        "num_inlinks": page_info[pageid]["num_inlinks"],
-                        "is_disambiguation_page": page_info[pageid]["is_disambiguation_page"],
-                        "is_sexual_page": page_info[pageid]["is_sexual_page"],
-                        "is_violent_page": page_info[pageid]["is_violent_page"],
-                    }
+        for passage_item in tqdm(iter_items(args.passages_file, columns=tuple(PASSAGE_FIELDS))):
+            page_item = page_info[passage_item["pageid"]]
+            yield {
+                "_index": index_name,
+                "_source": {
+                    "id": passage_item["id"],
+                    "pageid": passage_item["pageid"],
+                    "revid": passage_item["revid"],
+                    "title": passage_item["title"],
+                    "section": passage_item["section"],
+                    "text": passage_item["text"],
+                    "num_inlinks": page_item["num_inlinks"],
+                    "is_disambiguation_page": page_item["is_disambiguation_page"],
+                    "is_sexual_page": page_item["is_sexual_page"],
+                    "is_violent_page": page_item["is_violent_page"],
                 }
+            }
+
+    if optimize_for_ingest:
+        ingest_context = ingest_settings(es, index_name, max_num_segments=args.max_num_segments)
+    else:
+        ingest_context = nullcontext()
+
+    num_errors = 0
+    with ingest_context, open(args.error_file, "w") if args.error_file is not None else nullcontext() as fe:
+        for ok, item in parallel_streaming_bulk(
+            es,
+            generate_bulk_actions(),
+            num_threads=args.bulk_num_threads,
+            chunk_size=args.bulk_chunk_size,
+            max_chunk_bytes=args.bulk_max_chunk_bytes,
+            max_retries=args.bulk_max_retries,
+        ):
+            if not ok:
+                num_errors += 1
+                if fe is not None:
+                    print(dumps(item), file=fe)
+
+    if num_errors > 0:
+        logger.warning("Failed to index %d documents", num_errors)
+
+
+def main(args):
+    es = Elasticsearch(hosts=[{"host": args.hostname, "port": args.port}], timeout=60)
+
+    if args.rebuild_with_alias:
+        if args.update_index:
+            raise ValueError("--update_index cannot be used with --rebuild_with_alias")
 
-    bulk(es, generate_bulk_actions())
+        with managed_rebuild(
+            es,
+            args.index_name,
+            health_status=args.wait_for_status,
+            warm_up_queries_file=args.warm_up_queries_file,
+            num_indices_to_keep=args.num_indices_to_keep,
+        ) as index_name:
+            build_index(es, index_name, args, optimize_for_ingest=True)
+    else:
+        build_index(es, args.index_name, args, optimize_for_ingest=args.optimize_for_ingest)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--passages_file", type=str, required=True)
-    parser.add_argument("--page_ids_file", type=str, required=True)
+    parser.add_argument("--page_ids_file", type=str, required=True,
+        help="Page IDs file or its binary version made by page_metadata.py")
     parser.add_argument("--index_name", type=str, required=True)
     parser.add_argument("--hostname", type=str, default="localhost")
     parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--update_index", action="store_true",
+        help="Add the passages to the existing index instead of creating a new one")
+    parser.add_argument("--delete_page_ids_files", nargs="+", type=str,
+        help="Page IDs files of the updated and deleted pages, whose documents are deleted before indexing")
+    parser.add_argument("--delete_batch_size", type=int, default=1000)
+    parser.add_argument("--bulk_num_threads", type=int, default=4)
+    parser.add_argument("--bulk_chunk_size", type=int, default=500,
+        help="Maximum number of documents in a bulk request")
+    parser.add_argument("--bulk_max_chunk_bytes", type=int, default=10 * 1024 * 1024,
+        help="Maximum size of a bulk request in bytes")
+    parser.add_argument("--bulk_max_retries", type=int, default=5,
+        help="Maximum number of retries of the documents rejected with 429 (Too Many Requests)")
+    parser.add_argument("--error_file", type=str,
+        help="Write the bulk responses of the documents failed to index to this file (one JSON per line)")
+    parser.add_argument("--optimize_for_ingest", action="store_true",
+        help="Disable replicas and refreshes of the index during indexing, "
+             "and restore them and force-merge the index afterwards")
+    parser.add_argument("--max_num_segments", type=int,
+        help="Number of segments to force-merge the index into with --optimize_for_ingest")
+    parser.add_argument("--rebuild_with_alias", action="store_true",
+        help="Build a new index named --index_name with a timestamp suffix with --optimize_for_ingest, "
+             "and move the alias --index_name to it once it is ready")
+    parser.add_argument("--wait_for_status", choices=("green", "yellow"), default="green",
+        help="Health status of the new index to wait for before moving the alias. "
+             "Use yellow for a single-node cluster, where replicas are never assigned")
+    parser.add_argument("--warm_up_queries_file", type=str,
+        help="File of search request bodies (one JSON per line) run on the new index before moving the alias")
+    parser.add_argument("--num_indices_to_keep", type=int, default=2,
+        help="Number of the latest versions of the index to keep, including the new one")
     args = parser.parse_args()
     main(args)
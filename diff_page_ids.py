@@ -0,0 +1,68 @@
+# Copyright 2022 Masatoshi Suzuki (@singletongue)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import argparse
+
+from logzero import logger
+from tqdm import tqdm
+
+from jsonl_io import dumps, loads
+
+
+def main(args):
+    logger.info("Loading the old Page IDs file.")
+    old_revids = dict()
+    with open(args.old_page_ids_file) as f:
+        for line in tqdm(f):
+            pageid_item = loads(line)
+            old_revids[pageid_item["pageid"]] = pageid_item["revid"]
+
+    logger.info("Comparing the new Page IDs file with the old one.")
+    num_added = 0
+    num_changed = 0
+    num_unchanged = 0
+    with open(args.new_page_ids_file) as f, open(args.updated_page_ids_file, "w") as fo:
+        for line in tqdm(f):
+            pageid_item = loads(line)
+            old_revid = old_revids.pop(pageid_item["pageid"], None)
+            if old_revid is None:
+                num_added += 1
+            elif old_revid != pageid_item["revid"]:
+                num_changed += 1
+            else:
+                num_unchanged += 1
+                continue
+
+            print(line.rstrip("\n"), file=fo)
+
+    # The pages remaining in the old Page IDs do not exist in the new Page IDs file
+    with open(args.deleted_page_ids_file, "w") as fo:
+        for pageid, revid in old_revids.items():
+            print(dumps({"pageid": pageid, "revid": revid}), file=fo)
+
+    logger.info("Added pages: %d", num_added)
+    logger.info("Changed pages: %d", num_changed)
+    logger.info("Deleted pages: %d", len(old_revids))
+    logger.info("Unchanged pages: %d", num_unchanged)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--old_page_ids_file", type=str, required=True)
+    parser.add_argument("--new_page_ids_file", type=str, required=True)
+    parser.add_argument("--updated_page_ids_file", type=str, required=True,
+        help="Output file of the items in the new Page IDs file whose pages are added or changed")
+    parser.add_argument("--deleted_page_ids_file", type=str, required=True,
+        help="Output file of the Page IDs which exist only in the old Page IDs file")
+    args = parser.parse_args()
+    main(args)
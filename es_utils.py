@@ -0,0 +1,288 @@
+# Copyright 2022 Masatoshi Suzuki (@singletongue)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import os
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from elasticsearch.helpers import streaming_bulk
+from logzero import logger
+
+
+VERSIONED_INDEX_NAME_PATTERN = re.compile(r"\d{14}")
+# The key in the _meta of the mappings marking an index as built successfully,
+# since Elasticsearch does not accept custom index settings
+COMPLETED_INDEX_META_KEY = "wikipedia_utils_completed"
+CIRRUS_SETTINGS_SNAPSHOT_VERSION = 1
+INGEST_SETTINGS = {
+    "number_of_replicas": 0,
+    "refresh_interval": -1,
+}
+
+
+@contextmanager
+def ingest_settings(es, index_name, max_num_segments=None):
+    # Disables replicas and refreshes of the index during a bulk load,
+    # and restores the original settings and force-merges the index afterwards.
+    # The settings not set explicitly in the index are restored to the defaults by setting them to None.
+    # The response is keyed by the concrete index name, which differs from index_name if it is an alias
+    settings_response = es.indices.get_settings(index=index_name)
+    if len(settings_response) != 1:
+        raise ValueError(f"{index_name} must point to exactly one index: {sorted(settings_response.keys())}")
+
+    concrete_index_name, index_settings = next(iter(settings_response.items()))
+    index_settings = index_settings["settings"]["index"]
+    original_settings = {key: index_settings.get(key) for key in INGEST_SETTINGS}
+
+    logger.info("Updating the settings of the index %s for ingestion: %s", concrete_index_name, INGEST_SETTINGS)
+    es.indices.put_settings(body={"index": INGEST_SETTINGS}, index=concrete_index_name)
+    try:
+        yield
+    finally:
+        logger.info("Restoring the index settings: %s", original_settings)
+        es.indices.put_settings(body={"index": original_settings}, index=concrete_index_name)
+
+    logger.info("Refreshing and force-merging the index")
+    es.indices.refresh(index=concrete_index_name)
+    if max_num_segments is None:
+        es.indices.forcemerge(index=concrete_index_name, request_timeout=3600)
+    else:
+        es.indices.forcemerge(index=concrete_index_name, max_num_segments=max_num_segments, request_timeout=3600)
+
+
+def parallel_streaming_bulk(
+    es,
+    actions,
+    num_threads=4,
+    chunk_size=500,
+    max_chunk_bytes=10 * 1024 * 1024,
+    max_retries=5,
+    initial_backoff=2,
+    max_backoff=600,
+    queue_size=10000,
+):
+    # Indexes the actions with multiple threads, each of which sends bulk requests of at most chunk_size actions and
+    # max_chunk_bytes bytes with elasticsearch.helpers.streaming_bulk.
+    # The items rejected with 429 are retried with exponential backoff up to max_retries times.
+    # Yields (ok, item) for each action in the order of completion, in the same format as streaming_bulk.
+    action_queue = queue.Queue(maxsize=queue_size)
+    result_queue = queue.Queue()
+    end_of_actions = object()
+
+    def iter_queued_actions():
+        while True:
+            action = action_queue.get()
+            if action is end_of_actions:
+                # let the other threads know the end of the actions
+                action_queue.put(end_of_actions)
+                return
+
+            yield action
+
+    def run_worker():
+        try:
+            for result in streaming_bulk(
+                es,
+                iter_queued_actions(),
+                chunk_size=chunk_size,
+                max_chunk_bytes=max_chunk_bytes,
+                raise_on_error=False,
+                max_retries=max_retries,
+                initial_backoff=initial_backoff,
+                max_backoff=max_backoff,
+            ):
+                result_queue.put(result)
+        except Exception as e:
+            result_queue.put(e)
+        finally:
+            result_queue.put(end_of_actions)
+
+    def feed_actions():
+        try:
+            for action in actions:
+                action_queue.put(action)
+        except Exception as e:
+            result_queue.put(e)
+        finally:
+            action_queue.put(end_of_actions)
+
+    threads = [threading.Thread(target=run_worker, daemon=True) for _ in range(num_threads)]
+    threads.append(threading.Thread(target=feed_actions, daemon=True))
+    for thread in threads:
+        thread.start()
+
+    num_running_workers = num_threads
+    while num_running_workers > 0:
+        result = result_queue.get()
+        if result is end_of_actions:
+            num_running_workers -= 1
+        elif isinstance(result, Exception):
+            raise result
+        else:
+            yield result
+
+
+def make_versioned_index_name(alias_name):
+    # e.g., jawiki-20240401-para -> jawiki-20240401-para-20240405123456
+    return "{}-{}".format(alias_name, time.strftime("%Y%m%d%H%M%S"))
+
+
+def get_aliased_indices(es, alias_name):
+    if not es.indices.exists_alias(name=alias_name):
+        if es.indices.exists(index=alias_name):
+            raise ValueError(f"{alias_name} is an index, not an alias. Delete or rename it to rebuild with an alias.")
+
+        return []
+
+    return list(es.indices.get_alias(name=alias_name).keys())
+
+
+def wait_for_health(es, index_name, status="green", timeout="30m"):
+    logger.info("Waiting for the index to be %s", status)
+    health = es.cluster.health(index=index_name, wait_for_status=status, timeout=timeout, request_timeout=3600)
+    if health["timed_out"]:
+        raise RuntimeError(f"The index {index_name} did not become {status}: {health['status']}")
+
+
+def warm_up(es, index_name, queries_file):
+    # Runs the search requests in the file (one JSON request body per line) so that the caches are hot
+    with open(queries_file) as f:
+        queries = [json.loads(line) for line in f if line.strip()]
+
+    logger.info("Warming up the index with %d queries", len(queries))
+    for query in queries:
+        es.search(index=index_name, body=query)
+
+
+def swap_alias(es, alias_name, index_name):
+    # Moves the alias from the old indices to the new index atomically
+    actions = [{"remove": {"index": old_index_name, "alias": alias_name}}
+               for old_index_name in get_aliased_indices(es, alias_name)]
+    actions.append({"add": {"index": index_name, "alias": alias_name}})
+
+    logger.info("Updating the aliases: %s", actions)
+    es.indices.update_aliases(body={"actions": actions})
+
+
+def mark_index_completed(es, index_name):
+    meta = es.indices.get_mapping(index=index_name)[index_name]["mappings"].get("_meta", {})
+    if not meta.get(COMPLETED_INDEX_META_KEY):
+        meta[COMPLETED_INDEX_META_KEY] = True
+        es.indices.put_mapping(body={"_meta": meta}, index=index_name)
+
+
+def delete_old_indices(es, alias_name, num_indices_to_keep=1):
+    # Deletes the old versions of the index, keeping the latest completed ones and the aliased ones.
+    # The versions not marked as completed (e.g., left by a killed build) are not counted nor deleted.
+    aliased_index_names = set(get_aliased_indices(es, alias_name))
+    index_names = sorted(
+        index_name for index_name, index in es.indices.get(index=f"{alias_name}-*").items()
+        if VERSIONED_INDEX_NAME_PATTERN.fullmatch(index_name[len(alias_name) + 1:])
+        and index["mappings"].get("_meta", {}).get(COMPLETED_INDEX_META_KEY)
+    )
+    for index_name in index_names[:max(len(index_names) - num_indices_to_keep, 0)]:
+        if index_name in aliased_index_names:
+            continue
+
+        logger.info("Deleting the old index %s", index_name)
+        es.indices.delete(index=index_name)
+
+
+@contextmanager
+def managed_rebuild(es, alias_name, health_status="green", warm_up_queries_file=None, num_indices_to_keep=1):
+    # Yields the name of a new versioned index to be built, and once it is built,
+    # moves the alias to it and deletes the old versions.
+    # The alias keeps pointing to the old index while building the new one,
+    # and the new index is deleted if the building fails.
+    # The indices serving the alias are complete, including those built before the completion marker was added
+    for aliased_index_name in get_aliased_indices(es, alias_name):
+        mark_index_completed(es, aliased_index_name)
+
+    index_name = make_versioned_index_name(alias_name)
+    logger.info("Building a new index %s for the alias %s", index_name, alias_name)
+    try:
+        yield index_name
+
+        wait_for_health(es, index_name, status=health_status)
+        if warm_up_queries_file is not None:
+            warm_up(es, index_name, warm_up_queries_file)
+    except BaseException:
+        # the partial index would be left with the ingestion settings otherwise
+        if es.indices.exists(index=index_name):
+            logger.warning("Deleting the partially built index %s", index_name)
+            es.indices.delete(index=index_name)
+
+        raise
+
+    swap_alias(es, alias_name, index_name)
+    mark_index_completed(es, index_name)
+    delete_old_indices(es, alias_name, num_indices_to_keep=num_indices_to_keep)
+
+
+def fetch_cirrus_settings_snapshot(language, timeout=60, max_retries=3):
+    # Fetches the settings and mappings of the CirrusSearch indices of a Wikipedia
+    # https://www.elastic.co/jp/blog/loading-wikipedia
+    wiki_endpoint = f"https://{language}.wikipedia.org/w/api.php"
+
+    def fetch(action):
+        for num_retries in range(max_retries + 1):
+            try:
+                response = requests.get(
+                    wiki_endpoint, {"action": action, "format": "json", "formatversion": 2}, timeout=timeout
+                )
+                response.raise_for_status()
+                return response.json()
+            except requests.RequestException:
+                if num_retries == max_retries:
+                    raise
+
+                logger.warning("Failed to fetch %s. Retrying", action)
+                time.sleep(2 ** num_retries)
+
+    return {
+        "version": CIRRUS_SETTINGS_SNAPSHOT_VERSION,
+        "language": language,
+        "fetched_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "settings": fetch("cirrus-settings-dump"),
+        "mappings": fetch("cirrus-mapping-dump"),
+    }
+
+
+def save_cirrus_settings_snapshot(snapshot, output_dir):
+    # e.g., cirrus-settings-ja-20240401000000.json
+    fetched_at = time.strptime(snapshot["fetched_at"], "%Y-%m-%dT%H:%M:%SZ")
+    output_file_name = "cirrus-settings-{}-{}.json".format(
+        snapshot["language"], time.strftime("%Y%m%d%H%M%S", fetched_at)
+    )
+    output_file = os.path.join(output_dir, output_file_name)
+    with open(output_file, "w") as fo:
+        json.dump(snapshot, fo, ensure_ascii=False, indent=2)
+
+    return output_file
+
+
+def load_cirrus_settings_snapshot(snapshot_file, language=None):
+    with open(snapshot_file) as f:
+        snapshot = json.load(f)
+
+    if snapshot.get("version") != CIRRUS_SETTINGS_SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported snapshot version: {snapshot.get('version')}")
+    if language is not None and snapshot["language"] != language:
+        raise ValueError(f"The snapshot is for {snapshot['language']}, not {language}")
+
+    return snapshot
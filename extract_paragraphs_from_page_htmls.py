@@ -12,27 +12,30 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import argparse
-import gzip
-import json
-from unicodedata import normalize
+from collections import deque
+from functools import partial
+from multiprocessing import Pool
 
 from bs4 import BeautifulSoup
 from logzero import logger
+from lxml import etree
 from tqdm import tqdm
 
+from file_io import COMPRESSIONS, open_file
+from jsonl_io import dumps, loads
+from parquet_io import PARAGRAPH_FIELDS, PARQUET_EXTENSION, ROW_GROUP_SIZE, ParquetItemWriter
+from text_normalization import normalize_paragraph_text
+
 
 DEFAULT_SECTIONS_TO_IGNORE = ["脚注", "出典", "参考文献", "関連項目", "外部リンク"]
 DEFAULT_TAGS_TO_REMOVE = ["table"]
 DEFAULT_TAGS_TO_EXTRACT = ["p"]
 DEFAULT_INNER_TAGS_TO_REMOVE = ["sup"]
 
-
-def normalize_text(text):
-    text = normalize("NFKC", text)
-    text = " ".join(text.split())
-    text = "".join(char for char in text if char.isprintable())
-    text = text.strip()
-    return text
+# The strings in these tags are not included in the .text of BeautifulSoup tags
+BS4_STRING_CONTAINER_TAGS = {"script", "style", "template"}
+BS4_PRESERVE_WHITESPACE_TAGS = {"pre", "textarea"}
+BS4_ASCII_SPACES = str.maketrans("", "", "\x20\x0a\x09\x0c\x0d")
 
 
 def extract_paragraphs_from_html(html, tags_to_extract, tags_to_remove, inner_tags_to_remove):
@@ -50,12 +53,152 @@ def extract_paragraphs_from_html(html, tags_to_extract, tags_to_remove, inner_ta
             for inner_tag in tag.find_all(inner_tags_to_remove):
                 inner_tag.clear()
 
-            paragraph_text = normalize_text(tag.text)
+            paragraph_text = normalize_paragraph_text(tag.text)
             yield (section_title, paragraph_text, tag.name)
 
         section = section.find_next_sibling(["section"])
 
 
+def collect_element_texts(element, texts, in_string_container=False, in_preserve_whitespace_tag=False):
+    in_string_container = in_string_container or element.tag in BS4_STRING_CONTAINER_TAGS
+    in_preserve_whitespace_tag = in_preserve_whitespace_tag or element.tag in BS4_PRESERVE_WHITESPACE_TAGS
+
+    def to_bs4_string(text):
+        # BeautifulSoup replaces a string consisting only of ASCII whitespaces with a single space or newline
+        if not in_preserve_whitespace_tag and text.translate(BS4_ASCII_SPACES) == "":
+            return "\n" if "\n" in text else " "
+        else:
+            return text
+
+    if element.text and not in_string_container:
+        texts.append(to_bs4_string(element.text))
+
+    for child in element:
+        # Comments and processing instructions do not have string tags, and their contents are not included
+        if isinstance(child.tag, str):
+            collect_element_texts(child, texts, in_string_container, in_preserve_whitespace_tag)
+        if child.tail and not in_string_container:
+            texts.append(to_bs4_string(child.tail))
+
+
+def get_element_text(element):
+    # Equivalent to the .text of a BeautifulSoup tag
+    ancestor_tags = set(ancestor.tag for ancestor in element.iterancestors())
+    texts = []
+    collect_element_texts(
+        element,
+        texts,
+        in_string_container=not ancestor_tags.isdisjoint(BS4_STRING_CONTAINER_TAGS),
+        in_preserve_whitespace_tag=not ancestor_tags.isdisjoint(BS4_PRESERVE_WHITESPACE_TAGS),
+    )
+    return "".join(texts)
+
+
+def clear_element(element):
+    # Equivalent to the .clear() of a BeautifulSoup tag, which keeps the text following the tag
+    element.text = None
+    del element[:]
+
+
+def extract_paragraphs_from_html_lxml(html, tags_to_extract, tags_to_remove, inner_tags_to_remove):
+    root = etree.HTML(html)
+    if root is None:
+        return
+
+    section_title = "__LEAD__"
+    section = next(root.iter("section"), None)
+    while section is not None:
+        h2 = next(section.iterdescendants("h2"), None)
+        if h2 is not None:
+            section_title = get_element_text(h2)
+
+        for tag in list(section.iterdescendants(*tags_to_remove)):
+            clear_element(tag)
+
+        for tag in list(section.iterdescendants(*tags_to_extract)):
+            for inner_tag in list(tag.iterdescendants(*inner_tags_to_remove)):
+                clear_element(inner_tag)
+
+            paragraph_text = normalize_paragraph_text(get_element_text(tag))
+            yield (section_title, paragraph_text, tag.tag)
+
+        section = next(section.itersiblings("section"), None)
+
+
+HTML_PARSERS = {
+    "bs4": extract_paragraphs_from_html,
+    "lxml": extract_paragraphs_from_html_lxml,
+}
+
+
+def extract_paragraphs_from_lines(
+    lines,
+    tags_to_extract,
+    tags_to_remove,
+    inner_tags_to_remove,
+    sections_to_ignore,
+    min_paragraph_length,
+    max_paragraph_length,
+    html_parser="bs4",
+    as_items=False,
+):
+    # Returns the paragraphs as a JSON Lines text, or as a list of the items if as_items is True
+    extract_paragraphs = HTML_PARSERS[html_parser]
+    output_items = []
+    output_lines = []
+    for line in lines:
+        input_item = loads(line.rstrip("\n"))
+        page_id = input_item["pageid"]
+        rev_id = input_item["revid"]
+        title = input_item["title"]
+        html = input_item["html"]
+
+        paragraph_index = 0
+        for item in extract_paragraphs(html, tags_to_extract, tags_to_remove, inner_tags_to_remove):
+            section_title, paragraph_text, tag_name = item
+
+            if section_title in sections_to_ignore:
+                continue
+            if len(paragraph_text) < min_paragraph_length:
+                continue
+            if len(paragraph_text) > max_paragraph_length:
+                continue
+
+            output_item = {
+                "id": "{}-{}-{}".format(page_id, rev_id, paragraph_index),
+                "pageid": page_id,
+                "revid": rev_id,
+                "paragraph_index": paragraph_index,
+                "title": title,
+                "section": section_title,
+                "text": paragraph_text,
+                "html_tag": tag_name,
+            }
+            if as_items:
+                output_items.append(output_item)
+            else:
+                output_lines.append(dumps(output_item) + "\n")
+
+            paragraph_index += 1
+
+    if as_items:
+        return output_items
+
+    return "".join(output_lines)
+
+
+def iter_chunks(lines, chunk_size):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+
+    if len(chunk) > 0:
+        yield chunk
+
+
 def main(args):
     if args.tags_to_extract is not None:
         tags_to_extract = args.tags_to_extract
@@ -82,37 +225,60 @@ def main(args):
     logger.info("inner_tags_to_remove: %s", inner_tags_to_remove)
     logger.info("sections_to_ignore: %s", sections_to_ignore)
 
-    with gzip.open(args.page_htmls_file, "rt") as f, gzip.open(args.output_file, "wt") as fo:
-        for line in tqdm(f):
-            input_item = json.loads(line.rstrip("\n"))
-            page_id = input_item["pageid"]
-            rev_id = input_item["revid"]
-            title = input_item["title"]
-            html = input_item["html"]
-
-            paragraph_index = 0
-            for item in extract_paragraphs_from_html(html, tags_to_extract, tags_to_remove, inner_tags_to_remove):
-                section_title, paragraph_text, tag_name = item
-
-                if section_title in sections_to_ignore:
-                    continue
-                if len(paragraph_text) < args.min_paragraph_length:
-                    continue
-                if len(paragraph_text) > args.max_paragraph_length:
-                    continue
-
-                output_item = {
-                    "id": "{}-{}-{}".format(page_id, rev_id, paragraph_index),
-                    "pageid": page_id,
-                    "revid": rev_id,
-                    "paragraph_index": paragraph_index,
-                    "title": title,
-                    "section": section_title,
-                    "text": paragraph_text,
-                    "html_tag": tag_name,
-                }
-                print(json.dumps(output_item, ensure_ascii=False), file=fo)
-                paragraph_index += 1
+    process_lines = partial(
+        extract_paragraphs_from_lines,
+        tags_to_extract=tags_to_extract,
+        tags_to_remove=tags_to_remove,
+        inner_tags_to_remove=inner_tags_to_remove,
+        sections_to_ignore=sections_to_ignore,
+        min_paragraph_length=args.min_paragraph_length,
+        max_paragraph_length=args.max_paragraph_length,
+        html_parser=args.html_parser,
+        as_items=args.output_file.endswith(PARQUET_EXTENSION),
+    )
+
+    if args.output_file.endswith(PARQUET_EXTENSION):
+        fo = ParquetItemWriter(
+            args.output_file,
+            PARAGRAPH_FIELDS,
+            row_group_size=args.row_group_size,
+            compression=args.compression or "zstd",
+            compression_level=args.compression_level,
+        )
+        write_output = fo.write_items
+    else:
+        fo = open_file(
+            args.output_file,
+            "wt",
+            compression=args.compression,
+            compression_level=args.compression_level,
+            num_threads=args.compression_threads,
+            default_compression="gzip",
+        )
+        write_output = fo.write
+
+    with open_file(args.page_htmls_file, "rt", num_threads=args.compression_threads) as f, fo, \
+         tqdm(unit="pages") as pbar:
+        if args.num_workers is None:
+            for line in f:
+                write_output(process_lines([line]))
+                pbar.update(1)
+        else:
+            # The chunks of pages are processed in parallel and their results are written in the input order.
+            # The number of chunks in flight is bounded so that the input is not read faster than it is processed.
+            with Pool(args.num_workers) as pool:
+                pending_results = deque()
+                for chunk in iter_chunks(f, args.chunk_size):
+                    pending_results.append((len(chunk), pool.apply_async(process_lines, (chunk,))))
+                    if len(pending_results) >= args.num_workers * 2:
+                        num_lines, result = pending_results.popleft()
+                        write_output(result.get())
+                        pbar.update(num_lines)
+
+                while pending_results:
+                    num_lines, result = pending_results.popleft()
+                    write_output(result.get())
+                    pbar.update(num_lines)
 
 
 if __name__ == "__main__":
@@ -125,5 +291,22 @@ if __name__ == "__main__":
     parser.add_argument("--sections_to_ignore", nargs="+", type=str)
     parser.add_argument("--min_paragraph_length", type=int, default=10)
     parser.add_argument("--max_paragraph_length", type=int, default=1000)
+    parser.add_argument("--html_parser", choices=list(HTML_PARSERS.keys()), default="bs4",
+        help="bs4: parse the HTMLs with BeautifulSoup, lxml: work directly on the lxml trees, which is faster")
+    parser.add_argument("--num_workers", type=int,
+        help="Number of worker processes. The pages are processed in the main process if not specified")
+    parser.add_argument("--chunk_size", type=int, default=100,
+        help="Number of pages sent to a worker process at a time")
+    parser.add_argument("--compression", choices=COMPRESSIONS,
+        help="Compression of the output file. Inferred from its extension (.gz or .zst) if not specified, "
+             "and gzip for the other extensions. "
+             "For a Parquet output file (.parquet), the compression codec of its pages (default: zstd)")
+    parser.add_argument("--compression_level", type=int,
+        help="Compression level of the output file (default: 9 for gzip, 3 for zstd)")
+    parser.add_argument("--compression_threads", type=int, default=1,
+        help="Number of threads compressing the output file. "
+             "For gzip, pigz is used to compress and decompress the files in separate processes if installed")
+    parser.add_argument("--row_group_size", type=int, default=ROW_GROUP_SIZE,
+        help="Number of paragraphs in a row group of a Parquet output file (.parquet)")
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,157 @@
+# Copyright 2022 Masatoshi Suzuki (@singletongue)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import gzip
+import io
+import shutil
+import subprocess
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+COMPRESSIONS = ("gzip", "zstd", "none")
+EXTENSIONS = {".gz": "gzip", ".zst": "zstd"}
+MAGIC_NUMBERS = {b"\x1f\x8b": "gzip", b"\x28\xb5\x2f\xfd": "zstd"}
+BUFFER_SIZE = 1024 * 1024
+
+
+class ProcessReader(io.RawIOBase):
+    # Reads the standard output of a decompressor process, which runs in parallel with the Python process
+    def __init__(self, command):
+        self.process = subprocess.Popen(command, stdout=subprocess.PIPE)
+        self.is_eof = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        num_bytes = self.process.stdout.readinto(b)
+        if num_bytes == 0:
+            self.is_eof = True
+
+        return num_bytes
+
+    def close(self):
+        if not self.closed:
+            self.process.stdout.close()
+            # the process is stopped if the file is closed before reaching the end
+            if not self.is_eof:
+                self.process.kill()
+            if self.process.wait() != 0 and self.is_eof:
+                raise subprocess.CalledProcessError(self.process.returncode, self.process.args)
+
+        super().close()
+
+
+class ProcessWriter(io.RawIOBase):
+    # Writes to the standard input of a compressor process, whose output is written to the file
+    def __init__(self, command, file):
+        with open(file, "wb") as fo:
+            self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=fo)
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        return self.process.stdin.write(b)
+
+    def close(self):
+        if not self.closed:
+            self.process.stdin.close()
+            if self.process.wait() != 0:
+                raise subprocess.CalledProcessError(self.process.returncode, self.process.args)
+
+        super().close()
+
+
+def infer_compression(file, default="none"):
+    # Infers the compression of an output file from its extension
+    for extension, compression in EXTENSIONS.items():
+        if file.endswith(extension):
+            return compression
+
+    return default
+
+
+def detect_compression(file):
+    # Detects the compression of an input file from its first bytes
+    with open(file, "rb") as f:
+        head = f.read(4)
+
+    for magic_number, compression in MAGIC_NUMBERS.items():
+        if head.startswith(magic_number):
+            return compression
+
+    return "none"
+
+
+def open_compressed_file(file, mode, compression, compression_level=None, num_threads=1):
+    if compression == "gzip":
+        # pigz compresses with multiple threads, and decompresses in a separate process
+        pigz = shutil.which("pigz") if num_threads > 1 else None
+        if mode == "r":
+            if pigz is not None:
+                return io.BufferedReader(ProcessReader([pigz, "-d", "-c", file]), BUFFER_SIZE)
+
+            return io.BufferedReader(gzip.open(file, "rb"), BUFFER_SIZE)
+        else:
+            compression_level = compression_level if compression_level is not None else 9
+            if pigz is not None:
+                command = [pigz, "-c", f"-{compression_level}", "-p", str(num_threads)]
+                return io.BufferedWriter(ProcessWriter(command, file), BUFFER_SIZE)
+
+            return io.BufferedWriter(gzip.open(file, "wb", compresslevel=compression_level), BUFFER_SIZE)
+    elif compression == "zstd":
+        if zstandard is None:
+            raise ImportError("zstandard is required for reading or writing zstd files: pip install zstandard")
+
+        if mode == "r":
+            reader = zstandard.ZstdDecompressor().stream_reader(
+                open(file, "rb"), read_size=BUFFER_SIZE, read_across_frames=True, closefd=True
+            )
+            return io.BufferedReader(reader, BUFFER_SIZE)
+        else:
+            compression_level = compression_level if compression_level is not None else 3
+            # zstandard compresses in the calling thread if threads is 0
+            threads = num_threads if num_threads > 1 else 0
+            compressor = zstandard.ZstdCompressor(level=compression_level, threads=threads)
+            writer = compressor.stream_writer(open(file, "wb"), write_return_read=True, closefd=True)
+            return io.BufferedWriter(writer, BUFFER_SIZE)
+    elif compression == "none":
+        return open(file, mode + "b", buffering=BUFFER_SIZE)
+    else:
+        raise ValueError(f"Unknown compression: {compression}")
+
+
+def open_file(file, mode="rb", compression=None, compression_level=None, num_threads=1, default_compression="none"):
+    # Opens a file compressed with gzip or zstd, or not compressed, in the same way as gzip.open().
+    # The compression of a file to read is detected from its content,
+    # and that of a file to write is inferred from its extension if not specified.
+    # num_threads is the number of threads used for the compression (and a separate process for the decompression
+    # of gzip files), which requires pigz for gzip.
+    if mode not in ("r", "rt", "rb", "w", "wt", "wb"):
+        raise ValueError(f"Invalid mode: {mode}")
+
+    if mode[0] == "r":
+        compression = detect_compression(file)
+    elif compression is None:
+        compression = infer_compression(file, default=default_compression)
+
+    f = open_compressed_file(file, mode[0], compression, compression_level=compression_level, num_threads=num_threads)
+    if "t" not in mode:
+        return f
+
+    return io.TextIOWrapper(f, encoding="utf-8")
@@ -12,38 +12,69 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import argparse
-import gzip
-import json
+import re
 
 from logzero import logger
 from tqdm import tqdm
 
+from file_io import open_file
+from jsonl_io import loads
+from page_metadata import load_page_metadata
+
+
+# The pageid is read from the beginning of each line without parsing the whole JSON (e.g., of a page HTML).
+# A '"pageid":' cannot appear in a JSON string, in which the double quotes are escaped.
+# The line is fully parsed if the pageid is not found in the scanned range or may be in a nested object.
+PAGEID_PATTERN = re.compile(rb'"pageid":\s*(\d+)\s*[,}]')
+MAX_SCAN_BYTES = 4096
 
-def main(args):
-    logger.info("Loading Page IDs from file.")
-    page_ids = set(json.loads(line)["pageid"] for line in tqdm(open(args.pageids_file)))
-    logger.info("Loaded %d Page IDs.", len(page_ids))
 
-    logger.info("Filtering input file by the Page IDs.")
+def get_pageid(line):
+    match = PAGEID_PATTERN.search(line, 0, MAX_SCAN_BYTES)
+    if match is not None and line.startswith(b"{") and line.find(b"{", 1, match.start()) == -1:
+        return int(match.group(1))
+
+    return loads(line)["pageid"]
+
+
+def filter_file(input_file, output_file, page_ids):
     n_skipped = 0
-    with gzip.open(args.input_file, "rt") if args.input_file.endswith(".gz") else open(args.input_file) as f, \
-         gzip.open(args.output_file, "wt") if args.output_file.endswith(".gz") else open(args.output_file, "w") as fo:
+    with open_file(input_file, "rb") as f, open_file(output_file, "wb") as fo:
         for line in tqdm(f):
-            item = json.loads(line)
-            if item["pageid"] not in page_ids:
+            if get_pageid(line) not in page_ids:
                 n_skipped += 1
                 continue
 
-            print(line.rstrip("\n"), file=fo)
+            if not line.endswith(b"\n"):
+                line += b"\n"
+
+            fo.write(line)
+
+    return n_skipped
+
+
+def main(args):
+    if len(args.input_files) != len(args.output_files):
+        raise ValueError("The numbers of the input files and the output files must be the same")
+
+    logger.info("Loading Page IDs from file.")
+    page_ids = load_page_metadata(args.pageids_file)
+    logger.info("Loaded %d Page IDs.", len(page_ids))
+
+    for input_file, output_file in zip(args.input_files, args.output_files):
+        logger.info("Filtering %s by the Page IDs.", input_file)
+        n_skipped = filter_file(input_file, output_file, page_ids)
 
-    logger.info("Finished processing input file.")
-    logger.info("%d items have been skipped.", n_skipped)
+        logger.info("Finished processing %s.", input_file)
+        logger.info("%d items have been skipped.", n_skipped)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument("--input_file", type=str, required=True)
-    parser.add_argument("--pageids_file", type=str, required=True)
-    parser.add_argument("--output_file", type=str, required=True)
+    parser.add_argument("--input_file", "--input_files", dest="input_files", nargs="+", type=str, required=True)
+    parser.add_argument("--pageids_file", type=str, required=True,
+        help="Page IDs file or its binary version made by page_metadata.py")
+    parser.add_argument("--output_file", "--output_files", dest="output_files", nargs="+", type=str, required=True,
+        help="Output files, one for each of the input files")
     args = parser.parse_args()
     main(args)
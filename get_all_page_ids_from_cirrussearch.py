@@ -12,19 +12,24 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import argparse
-import gzip
-import json
 
 from tqdm import tqdm
 
+from file_io import open_file
+from jsonl_io import dumps, make_decoder
+
+
+# The texts of the pages are skipped without being decoded
+decode_cirrus_item = make_decoder(("index", "title", "version", "incoming_links", "template"))
+
 
 def main(args):
-    with gzip.open(args.cirrus_file, "rt") as f, open(args.output_file, "w") as fo:
+    with open_file(args.cirrus_file, "rt") as f, open(args.output_file, "w") as fo:
         title = None
         pageid = None
         revid = None
         for line in tqdm(f):
-            item = json.loads(line)
+            item = decode_cirrus_item(line)
             if "index" in item:
                 pageid = int(item["index"]["_id"])
             else:
@@ -48,7 +53,7 @@ def main(args):
                     "is_sexual_page": is_sexual_page,
                     "is_violent_page": is_violent_page,
                 }
-                print(json.dumps(output_item, ensure_ascii=False), file=fo)
+                print(dumps(output_item), file=fo)
 
 
 if __name__ == "__main__":
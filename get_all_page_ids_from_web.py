@@ -12,11 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import argparse
-import json
 
 import requests
 from tqdm import tqdm
 
+from jsonl_io import dumps
+
 
 def main(args):
     base_url = f"https://{args.language}.wikipedia.org/w/api.php"
@@ -42,7 +43,7 @@ def main(args):
                         "revid": page_item["revisions"][0]["revid"]
                     }
 
-                    print(json.dumps(output_item, ensure_ascii=False), file=fo)
+                    print(dumps(output_item), file=fo)
                     pbar.update(1)
 
             if "continue" in page_response:
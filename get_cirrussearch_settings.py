@@ -0,0 +1,36 @@
+# Copyright 2022 Masatoshi Suzuki (@singletongue)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import argparse
+
+from logzero import logger
+
+from es_utils import fetch_cirrus_settings_snapshot, save_cirrus_settings_snapshot
+
+
+def main(args):
+    logger.info("Fetching the settings and mappings")
+    snapshot = fetch_cirrus_settings_snapshot(args.language, timeout=args.timeout, max_retries=args.max_retries)
+
+    output_file = save_cirrus_settings_snapshot(snapshot, args.output_dir)
+    logger.info("Saved the settings and mappings to %s", output_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--language", type=str, required=True)
+    parser.add_argument("--output_dir", type=str, required=True)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--max_retries", type=int, default=3)
+    args = parser.parse_args()
+    main(args)
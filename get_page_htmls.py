@@ -12,38 +12,150 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import argparse
+import asyncio
 import gzip
-import json
-from time import sleep
+import os
+import random
+import tempfile
+import time
+import zlib
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from urllib.parse import quote_plus
 
-import grequests
+import aiohttp
 import requests
 from logzero import logger
-from tqdm import tqdm, trange
+from tqdm import tqdm
 
+from jsonl_io import dumps, loads, make_decoder
 
-def handle_request_exception(request, exception):
-    logger.warning("Request to {} failed: {}".format(request.url, exception))
 
+# Responses with these status codes are retried in the adaptive concurrency mode
+THROTTLING_STATUS_CODES = {429, 503}
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
 
-def main(args):
-    if args.batch_size > 200:
-        raise ValueError("batch_size is limited to be no more than 200.")
+# Only the keys of the fetched pages are decoded, skipping their HTMLs
+decode_page_key = make_decoder(("pageid", "revid"))
+
+
+class GzipMemberWriter(object):
+    def __init__(self, output_file, checkpoint_interval, append=False, compression_level=9):
+        self.fo = open(output_file, "ab" if append else "wb")
+        self.checkpoint_interval = checkpoint_interval
+        self.compression_level = compression_level
+        self.num_items_in_member = 0
+        self.member = gzip.GzipFile(fileobj=self.fo, mode="wb", compresslevel=self.compression_level)
+
+    def write(self, item):
+        self.member.write((dumps(item) + "\n").encode("utf-8"))
+        self.num_items_in_member += 1
+        if self.num_items_in_member >= self.checkpoint_interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        # Finish the current gzip member so that everything written so far survives a crash.
+        self.member.close()
+        self.fo.flush()
+        os.fsync(self.fo.fileno())
+        self.num_items_in_member = 0
+        self.member = gzip.GzipFile(fileobj=self.fo, mode="wb", compresslevel=self.compression_level)
+
+    def close(self):
+        self.member.close()
+        self.fo.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def scan_fetched_pages(output_file):
+    # Returns the (pageid, revid) pairs stored in the complete gzip members of the output file
+    # and the byte offset where the complete members end.
+    fetched_pages = set()
+    valid_offset = 0
+    member_pages = []
+    member_buffer = b""
+    decompressor = zlib.decompressobj(wbits=31)
+    with open(output_file, "rb") as f:
+        chunk_offset = 0
+        chunk = f.read(1 << 20)
+        while chunk:
+            try:
+                data = decompressor.decompress(chunk)
+            except zlib.error as e:
+                logger.warning("Corrupted data found after offset %s of %s: %s", valid_offset, output_file, e)
+                break
+
+            *lines, member_buffer = (member_buffer + data).split(b"\n")
+            member_pages.extend((item["pageid"], item["revid"]) for item in map(decode_page_key, lines))
+
+            if decompressor.eof:
+                member_end_offset = chunk_offset + len(chunk) - len(decompressor.unused_data)
+                if member_buffer == b"":
+                    fetched_pages.update(member_pages)
+                    valid_offset = member_end_offset
+
+                member_pages = []
+                member_buffer = b""
+                chunk = decompressor.unused_data
+                chunk_offset = member_end_offset
+                decompressor = zlib.decompressobj(wbits=31)
+                if chunk:
+                    continue
+
+            chunk_offset = f.tell()
+            chunk = f.read(1 << 20)
+
+    return fetched_pages, valid_offset
+
+
+class SpillableList(object):
+    def __init__(self, max_items_in_memory):
+        self.max_items_in_memory = max_items_in_memory
+        self.items = []
+        self.spill_file = None
+        self.num_spilled_items = 0
+
+    def append(self, item):
+        if len(self.items) < self.max_items_in_memory:
+            self.items.append(item)
+            return
+
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile("w+")
+
+        print(dumps(item), file=self.spill_file)
+        self.num_spilled_items += 1
+
+    def __len__(self):
+        return len(self.items) + self.num_spilled_items
+
+    def __iter__(self):
+        yield from self.items
+        if self.spill_file is not None:
+            self.spill_file.flush()
+            self.spill_file.seek(0)
+            for line in self.spill_file:
+                yield loads(line)
 
-    base_url = "https://{}.wikipedia.org/api/rest_v1".format(args.language)
 
-    # Load page ids from file
-    logger.info("Loading Page IDs from file.")
-    page_items = []
-    with open(args.page_ids_file) as f:
-        for line in tqdm(f):
-            loaded_item = json.loads(line)
+def generate_page_items(page_ids_file, base_url, mobile, fetched_pages, journaled_failed_pages, failed_pages):
+    with open(page_ids_file) as f:
+        for line in f:
+            loaded_item = loads(line)
             title = loaded_item["title"]
             pageid = loaded_item["pageid"]
             revid = loaded_item["revid"]
 
-            if args.mobile:
+            if (pageid, revid) in fetched_pages:
+                continue
+
+            if mobile:
                 url = "{}/page/mobile-html/{}/{}".format(base_url, quote_plus(title.replace(" ", "_")), revid)
             else:
                 url = "{}/page/html/{}/{}".format(base_url, quote_plus(title.replace(" ", "_")), revid)
@@ -54,41 +166,336 @@ def main(args):
                 "revid": revid,
                 "url": url,
             }
-            page_items.append(page_item)
+            if (pageid, revid) in journaled_failed_pages:
+                # Pages which failed in the previous runs are sent directly to the retry phase
+                failed_pages.append(page_item)
+            else:
+                yield page_item
+
+
+class TokenBucket(object):
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last_refill_time = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        # The lock makes the waiting tasks take the tokens in FIFO order.
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill_time) * self.rate)
+                self.last_refill_time = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AdaptiveConcurrencyLimiter(object):
+    def __init__(self, min_limit, max_limit, target_p95_latency=None, window_size=100):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min_limit)
+        self.target_p95_latency = target_p95_latency
+        self.latencies = deque(maxlen=window_size)
+        self.num_in_flight = 0
+        self.condition = asyncio.Condition()
+        self.last_decrease_time = 0.0
+        self.paused_until = 0.0
+
+    async def acquire(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.num_in_flight < int(self.limit))
+            self.num_in_flight += 1
+
+        # All the requests wait for the time specified by the Retry-After header of a throttled response
+        delay = self.paused_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def release(self):
+        async with self.condition:
+            self.num_in_flight -= 1
+            self.condition.notify_all()
+
+    def p95_latency(self):
+        if len(self.latencies) == 0:
+            return None
+
+        return sorted(self.latencies)[int(0.95 * (len(self.latencies) - 1))]
+
+    def record_success(self, latency):
+        self.latencies.append(latency)
+        if (
+            self.target_p95_latency is not None
+            and len(self.latencies) == self.latencies.maxlen
+            and self.p95_latency() > self.target_p95_latency
+        ):
+            self.decrease()
+        else:
+            # Additive increase: the limit grows by one after a full window of successful requests
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def record_congestion(self, retry_after=None):
+        if retry_after is not None:
+            self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+        self.decrease()
+
+    def decrease(self):
+        # Multiplicative decrease, applied at most once per second
+        # so that a burst of errors caused by the same congestion counts only once
+        now = time.monotonic()
+        if now - self.last_decrease_time < 1.0:
+            return
+
+        self.limit = max(self.min_limit, self.limit / 2)
+        self.latencies.clear()
+        self.last_decrease_time = now
+
+
+class FetchStatistics(object):
+    def __init__(self, window_size=1000):
+        self.outcomes = deque(maxlen=window_size)
+
+    def record(self, outcome):
+        self.outcomes.append(outcome)
+
+    def rate(self, outcome):
+        if len(self.outcomes) == 0:
+            return 0.0
+
+        return self.outcomes.count(outcome) / len(self.outcomes)
 
+
+def parse_retry_after(value):
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_time = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(0.0, (retry_time - datetime.now(timezone.utc)).total_seconds())
+
+
+async def fetch_page_html(session, url, rate_limiter, statistics):
+    await rate_limiter.acquire()
+    try:
+        async with session.get(url) as response:
+            response.raise_for_status()
+            html = await response.text()
+    except aiohttp.ClientResponseError:
+        statistics.record("http_error")
+        raise
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        statistics.record("connection_error")
+        raise
+
+    statistics.record("success")
+    return html
+
+
+async def fetch_page_html_with_retries(session, url, rate_limiter, concurrency_limiter, statistics, args):
+    for num_retries in range(args.max_retries + 1):
+        retry_after = None
+        await concurrency_limiter.acquire()
+        await rate_limiter.acquire()
+        start_time = time.monotonic()
+        try:
+            async with session.get(url) as response:
+                if response.status in THROTTLING_STATUS_CODES:
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    concurrency_limiter.record_congestion(retry_after)
+                    statistics.record("throttled")
+                elif response.status in RETRYABLE_STATUS_CODES:
+                    statistics.record("http_error")
+                elif response.status >= 400:
+                    # Other client errors (e.g., 404 for deleted revisions) are not worth retrying
+                    statistics.record("http_error")
+                    response.raise_for_status()
+                else:
+                    html = await response.text()
+                    concurrency_limiter.record_success(time.monotonic() - start_time)
+                    statistics.record("success")
+                    return html
+
+                error = aiohttp.ClientResponseError(
+                    response.request_info, response.history, status=response.status, message=response.reason
+                )
+        except aiohttp.ClientResponseError:
+            raise
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # Timeouts and connection errors are also signs of an overloaded server
+            concurrency_limiter.record_congestion()
+            statistics.record("connection_error")
+            error = e
+        finally:
+            await concurrency_limiter.release()
+
+        if num_retries == args.max_retries:
+            raise error
+
+        if retry_after is None:
+            retry_after = min(args.max_backoff, args.backoff_base * 2 ** num_retries) * random.uniform(0.5, 1.0)
+        await asyncio.sleep(retry_after)
+
+
+async def fetch_page_htmls(page_items, writer, failed_pages, failed_pages_journal, args):
     headers = {"User-Agent": args.user_agent}
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    connector = aiohttp.TCPConnector(limit=args.max_concurrent_requests)
 
-    # Retrieve page htmls
-    logger.info("Retrieving Page HTMLs")
-    failed_pages = []
-    with gzip.open(args.output_file, "wt") as fo:
-        for i in trange(0, len(page_items), args.batch_size):
-            batch_page_items = page_items[i:i + args.batch_size]
-
-            reqs = (
-                grequests.get(page_item["url"], headers=headers, timeout=args.timeout)
-                for page_item in batch_page_items
-            )
-            responses = grequests.map(reqs, exception_handler=handle_request_exception)
-            assert len(responses) == len(batch_page_items)
-
-            for page_item, response in zip(batch_page_items, responses):
-                if response is not None:
-                    page_item["html"] = response.text
-                    print(json.dumps(page_item, ensure_ascii=False), file=fo)
+    # Requests should be limited to 200 requests/sec.
+    # See https://www.mediawiki.org/wiki/REST_API.
+    # A small burst capacity absorbs the oversleeping of the event loop without exceeding the limit noticeably.
+    rate_limiter = TokenBucket(args.max_requests_per_second, capacity=max(1, args.max_requests_per_second / 20))
+
+    if args.adaptive_concurrency:
+        concurrency_limiter = AdaptiveConcurrencyLimiter(
+            args.min_concurrent_requests, args.max_concurrent_requests, args.target_p95_latency
+        )
+    else:
+        concurrency_limiter = None
+
+    statistics = FetchStatistics()
+
+    # The queue is bounded so that the page items are read from the file only as fast as they are fetched
+    page_queue = asyncio.Queue(maxsize=args.max_concurrent_requests * 2)
+
+    async def fetch_worker(session, pbar):
+        # Each worker keeps one request in flight and starts the next one as soon as it finishes,
+        # so a slow page does not stall the other requests.
+        while True:
+            page_item = await page_queue.get()
+            if page_item is None:
+                break
+
+            try:
+                if concurrency_limiter is not None:
+                    page_item["html"] = await fetch_page_html_with_retries(
+                        session, page_item["url"], rate_limiter, concurrency_limiter, statistics, args
+                    )
+                else:
+                    page_item["html"] = await fetch_page_html(session, page_item["url"], rate_limiter, statistics)
+            except Exception as e:
+                # Other errors (e.g., a UnicodeDecodeError for a broken page) also fail only the page,
+                # since a crashed worker would leave the bounded queue without a consumer
+                if not isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError)):
+                    statistics.record("other_error")
+
+                if concurrency_limiter is not None:
+                    logger.warning(
+                        "Request for the page %s (pageid=%s, revid=%s) failed: %s. Giving up on the page.",
+                        page_item["title"], page_item["pageid"], page_item["revid"], e,
+                    )
                 else:
                     logger.warning(
-                        "Request for the page %s (pageid=%s, revid=%s) failed. The request will be tried again later.",
-                        page_item["title"], page_item["pageid"], page_item["revid"],
+                        "Request for the page %s (pageid=%s, revid=%s) failed: %s. "
+                        "The request will be tried again later.",
+                        page_item["title"], page_item["pageid"], page_item["revid"], e,
                     )
-                    failed_pages.append(page_item)
+                failed_pages.append(page_item)
+                print(dumps(page_item), file=failed_pages_journal, flush=True)
+            else:
+                writer.write(page_item)
+            finally:
+                error_rate = sum(
+                    statistics.rate(outcome) for outcome in ("http_error", "connection_error", "other_error")
+                )
+                postfix = {
+                    "throttled": "{:.1%}".format(statistics.rate("throttled")),
+                    "errors": "{:.1%}".format(error_rate),
+                }
+                if concurrency_limiter is not None:
+                    postfix["concurrency"] = int(concurrency_limiter.limit)
+                    p95_latency = concurrency_limiter.p95_latency()
+                    if p95_latency is not None:
+                        postfix["p95"] = "{:.2f}s".format(p95_latency)
+
+                pbar.set_postfix(postfix, refresh=False)
+                pbar.update(1)
+
+    async with aiohttp.ClientSession(headers=headers, timeout=timeout, connector=connector) as session:
+        with tqdm(unit="pages") as pbar:
+            workers = [
+                asyncio.create_task(fetch_worker(session, pbar)) for _ in range(args.max_concurrent_requests)
+            ]
+            for page_item in page_items:
+                await page_queue.put(page_item)
+            for _ in workers:
+                await page_queue.put(None)
+
+            await asyncio.gather(*workers)
+
+
+def main(args):
+    if args.max_requests_per_second > 200:
+        raise ValueError("max_requests_per_second is limited to be no more than 200.")
 
-            # Requests should be limited to 200 requests/sec.
-            # See https://www.mediawiki.org/wiki/REST_API.
-            sleep(args.batch_size / 200)
+    if args.api_base_url is not None:
+        base_url = args.api_base_url.rstrip("/")
+    else:
+        base_url = "https://{}.wikipedia.org/api/rest_v1".format(args.language)
+
+    if args.failed_pages_file is not None:
+        failed_pages_file = args.failed_pages_file
+    else:
+        failed_pages_file = args.output_file + ".failed.json"
+
+    # Find the pages fetched in the previous runs
+    fetched_pages = set()
+    journaled_failed_pages = set()
+    if args.resume and os.path.exists(args.output_file):
+        logger.info("Scanning the existing output file.")
+        fetched_pages, valid_offset = scan_fetched_pages(args.output_file)
+        logger.info("Found %s pages already fetched.", len(fetched_pages))
+
+        # Drop the incomplete gzip member written when the previous run was terminated
+        if valid_offset < os.path.getsize(args.output_file):
+            logger.info("Truncating the output file to %s bytes.", valid_offset)
+            with open(args.output_file, "r+b") as f:
+                f.truncate(valid_offset)
+
+        if os.path.exists(failed_pages_file):
+            with open(failed_pages_file) as f:
+                for line in f:
+                    failed_item = loads(line)
+                    journaled_failed_pages.add((failed_item["pageid"], failed_item["revid"]))
+
+    failed_pages = SpillableList(args.max_failed_pages_in_memory)
+    if args.adaptive_concurrency:
+        # Failed requests are retried with backoff in the main phase, so there is no separate retry phase
+        journaled_failed_pages = set()
+
+    page_items = generate_page_items(
+        args.page_ids_file, base_url, args.mobile, fetched_pages, journaled_failed_pages, failed_pages
+    )
+
+    headers = {"User-Agent": args.user_agent}
+
+    # Retrieve page htmls
+    logger.info("Retrieving Page HTMLs")
+    with GzipMemberWriter(args.output_file, args.checkpoint_interval, append=args.resume,
+                          compression_level=args.compression_level) as writer, \
+         open(failed_pages_file, "a" if args.resume else "w") as failed_pages_journal:
+        asyncio.run(fetch_page_htmls(page_items, writer, failed_pages, failed_pages_journal, args))
 
         # Retry failed requests
-        if len(failed_pages) > 0:
+        if args.adaptive_concurrency:
+            if len(failed_pages) > 0:
+                logger.warning("Failed to fetch %s pages. They are recorded in %s", len(failed_pages), failed_pages_file)
+        elif len(failed_pages) > 0:
             logger.info("Retrying failed %s requests", len(failed_pages))
             for page_item in failed_pages:
                 try:
@@ -99,7 +506,7 @@ def main(args):
                     continue
 
                 page_item["html"] = response.text
-                print(json.dumps(page_item, ensure_ascii=False), file=fo)
+                writer.write(page_item)
 
 
 if __name__ == "__main__":
@@ -108,8 +515,33 @@ if __name__ == "__main__":
     parser.add_argument("--output_file", type=str, required=True)
     parser.add_argument("--language", type=str, required=True)
     parser.add_argument("--user_agent", type=str, required=True)
-    parser.add_argument("--batch_size", type=int, default=20)
+    parser.add_argument("--max_concurrent_requests", "--batch_size", type=int, default=20,
+        help="Number of requests kept in flight at the same time. "
+             "It is the upper bound of the concurrency if --adaptive_concurrency is enabled")
+    parser.add_argument("--max_requests_per_second", type=float, default=200)
     parser.add_argument("--timeout", type=int, default=60)
     parser.add_argument("--mobile", action="store_true")
+    parser.add_argument("--checkpoint_interval", type=int, default=1000,
+        help="Number of pages written to each gzip member of the output file. "
+             "The pages in complete members are kept when the process is terminated.")
+    parser.add_argument("--compression_level", type=int, default=9,
+        help="Compression level of the output file. Lower levels are faster and make a larger file")
+    parser.add_argument("--resume", action="store_true",
+        help="Skip the pages already in the output file and append the newly fetched pages to it")
+    parser.add_argument("--failed_pages_file", type=str,
+        help="Journal file of the failed pages. Defaults to the output file name suffixed by .failed.json")
+    parser.add_argument("--max_failed_pages_in_memory", type=int, default=10000,
+        help="The failed pages beyond this number are kept in a temporary file until the retry phase")
+    parser.add_argument("--adaptive_concurrency", action="store_true",
+        help="Adjust the number of requests in flight by AIMD based on the throttled responses and latencies, "
+             "and retry failed requests with exponential backoff")
+    parser.add_argument("--min_concurrent_requests", type=int, default=1)
+    parser.add_argument("--target_p95_latency", type=float,
+        help="Decrease the concurrency when the p95 latency of recent requests exceeds this value (in seconds)")
+    parser.add_argument("--max_retries", type=int, default=5)
+    parser.add_argument("--backoff_base", type=float, default=1.0)
+    parser.add_argument("--max_backoff", type=float, default=60.0)
+    parser.add_argument("--api_base_url", type=str,
+        help="Base URL of the REST API (e.g., a local caching proxy). Defaults to that of the specified language")
     args = parser.parse_args()
     main(args)
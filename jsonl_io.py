@@ -0,0 +1,82 @@
+# Copyright 2022 Masatoshi Suzuki (@singletongue)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+# The items are always encoded with the standard library, which is the same as json.dumps(item, ensure_ascii=False),
+# so that the output files do not depend on the installed packages
+JSON_ENCODER = json.JSONEncoder(ensure_ascii=False)
+
+
+def dumps(item):
+    return JSON_ENCODER.encode(item)
+
+
+if orjson is not None:
+    fast_loads = orjson.loads
+elif msgspec is not None:
+    fast_loads = msgspec.json.decode
+else:
+    fast_loads = None
+
+
+def loads(line):
+    # The fast decoders are stricter than the standard library (e.g., on lone surrogates or NaN),
+    # and such lines are decoded with the standard library
+    if fast_loads is not None:
+        try:
+            return fast_loads(line)
+        except ValueError:
+            pass
+
+    return json.loads(line)
+
+
+def make_decoder(fields):
+    # Returns a function decoding a line into a dict of the given fields, skipping the other fields with msgspec.
+    # Without msgspec, the lines are fully decoded and the dicts may have the other fields.
+    if msgspec is None:
+        return loads
+
+    decoder = msgspec.json.Decoder(msgspec.defstruct("Item", [(field, Any, msgspec.UNSET) for field in fields]))
+
+    def decode(line):
+        try:
+            item = decoder.decode(line)
+        except ValueError:
+            return loads(line)
+
+        return {field: value for field in fields if (value := getattr(item, field)) is not msgspec.UNSET}
+
+    return decode
+
+
+def iter_jsonl(f, decode=loads):
+    for line in f:
+        yield decode(line)
+
+
+def write_jsonl(fo, items):
+    fo.writelines(dumps(item) + "\n" for item in items)
@@ -0,0 +1,103 @@
+# Copyright 2022 Masatoshi Suzuki (@singletongue)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from functools import lru_cache
+
+from sentence_splitters import create_mecab_tagger
+
+
+class CharLengthFunction(object):
+    def __call__(self, text):
+        return len(text)
+
+    def measure_many(self, texts):
+        return list(map(len, texts))
+
+
+class MeCabTokenLengthFunction(object):
+    # Counts the MeCab tokens of a text.
+    # The lengths are cached since the same texts (e.g., sentences) are measured repeatedly in packing passages.
+    def __init__(self, mecab_option=None, cache_size=100000):
+        self.mecab = create_mecab_tagger(mecab_option)
+        self.measure = lru_cache(maxsize=cache_size)(self.count_tokens)
+
+    def count_tokens(self, text):
+        return len(self.mecab(text))
+
+    def __call__(self, text):
+        return self.measure(text)
+
+    def measure_many(self, texts):
+        return list(map(self.measure, texts))
+
+
+class SubwordLengthFunction(object):
+    # Counts the subword tokens of a text in the same way as the WordPiece tokenizers of BERT models:
+    # a text is split into words with MeCab and each word is split into subwords by the greedy longest-match-first
+    # algorithm with the vocabulary file (one subword per line, with the "##" prefix for non-initial subwords).
+    # A word which cannot be split into the subwords in the vocabulary is counted as one (unknown) token.
+    def __init__(self, vocab_file, mecab_option=None, max_input_chars_per_word=100, cache_size=100000):
+        with open(vocab_file) as f:
+            self.vocab = set(line.rstrip("\n") for line in f)
+
+        self.mecab = create_mecab_tagger(mecab_option)
+        self.max_input_chars_per_word = max_input_chars_per_word
+        self.count_word_subwords = lru_cache(maxsize=cache_size)(self.count_word_subwords)
+        self.measure = lru_cache(maxsize=cache_size)(self.count_subwords)
+
+    def count_word_subwords(self, word):
+        if len(word) > self.max_input_chars_per_word:
+            return 1
+
+        num_subwords = 0
+        start = 0
+        while start < len(word):
+            end = len(word)
+            while end > start:
+                subword = word[start:end]
+                if start > 0:
+                    subword = "##" + subword
+                if subword in self.vocab:
+                    break
+
+                end -= 1
+            else:
+                return 1
+
+            num_subwords += 1
+            start = end
+
+        return num_subwords
+
+    def count_subwords(self, text):
+        return sum(self.count_word_subwords(node.surface) for node in self.mecab(text))
+
+    def __call__(self, text):
+        return self.measure(text)
+
+    def measure_many(self, texts):
+        return list(map(self.measure, texts))
+
+
+def create_length_function(length_unit, mecab_option=None, vocab_file=None):
+    if length_unit == "char":
+        return CharLengthFunction()
+    elif length_unit == "mecab_token":
+        return MeCabTokenLengthFunction(mecab_option)
+    elif length_unit == "subword":
+        if vocab_file is None:
+            raise ValueError("vocab_file is required for measuring lengths in subwords")
+
+        return SubwordLengthFunction(vocab_file, mecab_option)
+    else:
+        raise ValueError(f"Invalid length unit: {length_unit}")
@@ -12,14 +12,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import argparse
-import gzip
-import json
+import os
 import re
-import unicodedata
+from collections import deque
+from multiprocessing import Pool
 
 from tqdm import tqdm
 
-from sentence_splitters import MeCabSentenceSplitter
+from file_io import COMPRESSIONS, open_file
+from jsonl_io import loads, make_decoder
+from sentence_splitters import SENTENCE_SPLITTER_CLASSES
+from text_normalization import normalize_nfkc, normalize_whitespaces, remove_non_printable_chars
 
 
 def filter_text(text):
@@ -30,75 +33,191 @@ def filter_text(text):
     return True
 
 
+# The patterns are applied one after another since a removal can make or break a match of the following patterns
+# (e.g., "{[1]{x}}" becomes "{{x}}" after removing "[1]"), which a single pass of an alternation would not reproduce.
+# Instead, each pattern is skipped when the text does not contain the literal part of the pattern.
+TEMPLATE_PATTERNS = [
+    ("[", re.compile(r"\[\d+?\]")),
+    ("[要", re.compile(r"\[要.+?\]")),
+    ("{{", re.compile(r"\{\{+[^{}]+?\}\}+")),
+]
+FOOTNOTE_PATTERN = re.compile(r" \^ .+")
+ANNOTATION_PATTERN = re.compile(r"\[(要出典|リンク切れ|.+?\?)\]")
+
+# The fields of the page lines other than the ones used by make_page_text() are skipped without being decoded
+decode_page_item = make_decoder(("title", "text", "template", "incoming_links"))
+
+
+def remove_navigation(text, title):
+    # Same as re.sub(r"^.+? \> " + re.escape(title), "", text),
+    # without compiling a regular expression for every title
+    index = text.find(" > " + title, 1)
+    if index == -1 or "\n" in text[:index]:
+        return text
+
+    return text[index + len(" > " + title):]
+
+
 def preprocess_text(text, title=None):
-    text = unicodedata.normalize("NFKC", text)
+    text = normalize_nfkc(text)
 
     # remove invisible characters
-    text = "".join(c for c in text if c.isprintable())
+    text = remove_non_printable_chars(text)
 
     # remove templates
-    text = re.sub(r"\[\d+?\]", "", text)
-    text = re.sub(r"\[要.+?\]", "", text)
-    text = re.sub(r"\{\{+[^{}]+?\}\}+", "", text)
+    for literal, pattern in TEMPLATE_PATTERNS:
+        if literal in text:
+            text = pattern.sub("", text)
 
     # remove navigation
     if title is not None:
-        text = re.sub(r"^.+? \> " + re.escape(title), "", text)
+        text = remove_navigation(text, title)
 
     # remove footnotes
-    text = re.sub(r" \^ .+", "", text)
+    if " ^ " in text:
+        text = FOOTNOTE_PATTERN.sub("", text)
     # remove annotations
-    text = re.sub(r"\[(要出典|リンク切れ|.+?\?)\]", "", text)
+    if "[" in text:
+        text = ANNOTATION_PATTERN.sub("", text)
 
-    text = re.sub(r"\s+", " ", text).strip()
+    text = normalize_whitespaces(text)
     return text
 
 
+def make_page_text(item, sent_splitter, args):
+    # Returns the sentences of a page, one per line, followed by a blank line for separating pages.
+    # An empty string is returned if the page is filtered out or has no sentences.
+    title = item["title"]
+    text = item["text"]
+    templates = item["template"]
+    num_inlinks = item.get("incoming_links", 0)
+
+    if args.min_inlinks is not None and num_inlinks < args.min_inlinks:
+        return ""
+    if args.exclude_disambiguation_pages and "Template:Dmbox" in templates:
+        return ""
+    if args.exclude_sexual_pages and "Template:性的" in templates:
+        return ""
+    if args.exclude_violent_pages and "Template:暴力的" in templates:
+        return ""
+
+    text = preprocess_text(text, title=title)
+
+    output_lines = []
+    for sentence in sent_splitter(text):
+        sentence = sentence.strip()
+        if len(sentence) < args.min_sentence_length:
+            continue
+        if len(sentence) > args.max_sentence_length:
+            continue
+        if not filter_text(sentence):
+            continue
+
+        assert not "\n" in text
+        assert sentence != ""
+        output_lines.append(sentence + "\n")
+
+    if len(output_lines) > 0:
+        # insert a newline for separating pages
+        output_lines.append("\n")
+
+    return "".join(output_lines)
+
+
+worker_sent_splitter = None
+worker_args = None
+
+
+def init_worker(args):
+    # Each worker process builds its own tagger only once
+    global worker_sent_splitter, worker_args
+    worker_sent_splitter = SENTENCE_SPLITTER_CLASSES[args.sentence_splitter](args.mecab_option)
+    worker_args = args
+
+
+def make_page_texts(page_lines):
+    page_texts = []
+    for index_line, page_line in page_lines:
+        assert "index" in loads(index_line)
+        page_texts.append(make_page_text(decode_page_item(page_line), worker_sent_splitter, worker_args))
+
+    return page_texts
+
+
+def iter_page_line_chunks(f, chunk_size):
+    # The dump file consists of pairs of an index line and a page line
+    chunk = []
+    for index_line in f:
+        page_line = next(f, None)
+        if page_line is None:
+            raise ValueError("The dump ends with an index line without a page line. It may be truncated.")
+
+        chunk.append((index_line, page_line))
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+
+    if len(chunk) > 0:
+        yield chunk
+
+
+def get_shard_file_name(output_file, shard_index, num_shards):
+    # e.g., corpus.txt.gz -> corpus-00000-of-00004.txt.gz
+    dirname, basename = os.path.split(output_file)
+    stem, dot, extension = basename.partition(".")
+    return os.path.join(dirname, "{}-{:05d}-of-{:05d}{}{}".format(stem, shard_index, num_shards, dot, extension))
+
+
 def main(args):
-    sent_splitter = MeCabSentenceSplitter(args.mecab_option)
-
-    with gzip.open(args.cirrus_file, "rt") as f, gzip.open(args.output_file, "wt") as fo:
-        for line in tqdm(f):
-            item = json.loads(line)
-            if "index" in item:
-                page_id = item["index"]["_id"]
-            else:
-                assert page_id is not None
-
-                title = item["title"]
-                text = item["text"]
-                templates = item["template"]
-                num_inlinks = item.get("incoming_links", 0)
-
-                if args.min_inlinks is not None and num_inlinks < args.min_inlinks:
-                    continue
-                if args.exclude_disambiguation_pages and "Template:Dmbox" in templates:
-                    continue
-                if args.exclude_sexual_pages and "Template:性的" in templates:
-                    continue
-                if args.exclude_violent_pages and "Template:暴力的" in templates:
-                    continue
-
-                text = preprocess_text(text, title=title)
-
-                is_processed = False
-                for sentence in sent_splitter(text):
-                    sentence = sentence.strip()
-                    if len(sentence) < args.min_sentence_length:
-                        continue
-                    if len(sentence) > args.max_sentence_length:
-                        continue
-                    if not filter_text(sentence):
-                        continue
-
-                    assert not "\n" in text
-                    assert sentence != ""
-                    print(sentence, file=fo)
-                    is_processed = True
-
-                if is_processed:
-                    # insert a newline for separating pages
-                    print("", file=fo)
+    if args.num_output_shards is None:
+        output_files = [args.output_file]
+    else:
+        output_files = [
+            get_shard_file_name(args.output_file, i, args.num_output_shards) for i in range(args.num_output_shards)
+        ]
+
+    fos = [
+        open_file(
+            output_file,
+            "wt",
+            compression=args.compression,
+            compression_level=args.compression_level,
+            num_threads=args.compression_threads,
+            default_compression="gzip",
+        )
+        for output_file in output_files
+    ]
+    num_pages = 0
+
+    def write_page_texts(page_texts):
+        # The pages are distributed to the shards in a round-robin manner
+        nonlocal num_pages
+        for page_text in page_texts:
+            fos[num_pages % len(fos)].write(page_text)
+            num_pages += 1
+
+        pbar.update(len(page_texts))
+
+    with open_file(args.cirrus_file, "rt", num_threads=args.compression_threads) as f, tqdm(unit="pages") as pbar:
+        if args.num_workers is None:
+            init_worker(args)
+            for chunk in iter_page_line_chunks(f, args.chunk_size):
+                write_page_texts(make_page_texts(chunk))
+        else:
+            # The chunks of pages are processed in parallel and their results are written in the input order.
+            # The number of chunks in flight is bounded so that the input is not read faster than it is processed.
+            with Pool(args.num_workers, init_worker, (args,)) as pool:
+                pending_results = deque()
+                for chunk in iter_page_line_chunks(f, args.chunk_size):
+                    pending_results.append(pool.apply_async(make_page_texts, (chunk,)))
+                    if len(pending_results) >= args.num_workers * 2:
+                        write_page_texts(pending_results.popleft().get())
+
+                while pending_results:
+                    write_page_texts(pending_results.popleft().get())
+
+    for fo in fos:
+        fo.close()
 
 
 if __name__ == "__main__":
@@ -106,11 +225,28 @@ if __name__ == "__main__":
     parser.add_argument("--cirrus_file", type=str, required=True)
     parser.add_argument("--output_file", type=str, required=True)
     parser.add_argument("--mecab_option", type=str)
+    parser.add_argument("--sentence_splitter", choices=SENTENCE_SPLITTER_CLASSES.keys(), default="mecab",
+        help="rule_based splits the texts with rules and uses MeCab only for the texts ambiguous to the rules")
     parser.add_argument("--min_sentence_length", type=int, default=20)
     parser.add_argument("--max_sentence_length", type=int, default=1000)
     parser.add_argument("--min_inlinks", type=int)
     parser.add_argument("--exclude_disambiguation_pages", action="store_true")
     parser.add_argument("--exclude_sexual_pages", action="store_true")
     parser.add_argument("--exclude_violent_pages", action="store_true")
+    parser.add_argument("--num_workers", type=int,
+        help="Number of worker processes. The pages are processed in the main process if not specified")
+    parser.add_argument("--chunk_size", type=int, default=100,
+        help="Number of pages sent to a worker process at a time")
+    parser.add_argument("--num_output_shards", type=int,
+        help="Write the pages into this number of files, whose names are made by inserting "
+             "the shard numbers into the --output_file (e.g., corpus-00000-of-00004.txt.gz)")
+    parser.add_argument("--compression", choices=COMPRESSIONS,
+        help="Compression of the output files. Inferred from its extension (.gz or .zst) if not specified, "
+             "and gzip for the other extensions")
+    parser.add_argument("--compression_level", type=int,
+        help="Compression level of the output files (default: 9 for gzip, 3 for zstd)")
+    parser.add_argument("--compression_threads", type=int, default=1,
+        help="Number of threads compressing each output file. "
+             "For gzip, pigz is used to compress and decompress the files in separate processes if installed")
     args = parser.parse_args()
     main(args)
@@ -12,81 +12,116 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import argparse
-import gzip
-import json
-import re
-import unicodedata
 
 from tqdm import tqdm
 
-from sentence_splitters import MeCabSentenceSplitter
+from file_io import COMPRESSIONS, open_file
+from page_metadata import load_page_metadata
+from parquet_io import iter_items
+from sentence_splitters import SENTENCE_SPLITTER_CLASSES, MultiprocessSentenceSplitter
+from text_normalization import normalize_corpus_text
 
 
-def preprocess_text(text):
-    text = unicodedata.normalize("NFKC", text)
-
-    text = "".join(c for c in text if c.isprintable())
-    text = re.sub(r"\s+", " ", text).strip()
-    return text
+# The fields of the paragraphs used for making the corpus, which are the only columns read from the paragraphs file
+PARAGRAPH_COLUMNS = ("pageid", "title", "text", "html_tag")
 
 
 def main(args):
-    sent_splitter = MeCabSentenceSplitter(args.mecab_option)
-
-    pageids_to_filter_out = set()
+    page_metadata = None
     if args.page_ids_file is not None:
-        with open(args.page_ids_file) as f:
-            for line in tqdm(f):
-                pageid_item = json.loads(line)
-                pageid = pageid_item["pageid"]
-
-                if args.min_inlinks is not None and pageid_item["num_inlinks"] < args.min_inlinks:
-                    pageids_to_filter_out.add(pageid)
-                    continue
-
-                if args.exclude_disambiguation_pages and pageid_item["is_disambiguation_page"]:
-                    pageids_to_filter_out.add(pageid)
-                    continue
-
-                if args.exclude_sexual_pages and pageid_item["is_sexual_page"]:
-                    pageids_to_filter_out.add(pageid)
-                    continue
-
-                if args.exclude_violent_pages and pageid_item["is_violent_page"]:
-                    pageids_to_filter_out.add(pageid)
-                    continue
-
-    with gzip.open(args.paragraphs_file, "rt") as f, gzip.open(args.output_file, "wt") as fo:
+        page_metadata = load_page_metadata(args.page_ids_file)
+
+    def is_page_filtered_out(pageid):
+        if page_metadata is None:
+            return False
+
+        pageid_item = page_metadata.get(pageid)
+        if pageid_item is None:
+            return False
+
+        if args.min_inlinks is not None:
+            if pageid_item["num_inlinks"] is None:
+                raise ValueError(
+                    f"{args.page_ids_file} does not have the number of inlinks of the page {pageid}, "
+                    "which is required for --min_inlinks. Use a page IDs file made by "
+                    "get_all_page_ids_from_cirrussearch.py, not by diff_page_ids.py."
+                )
+            if pageid_item["num_inlinks"] < args.min_inlinks:
+                return True
+        if args.exclude_disambiguation_pages and pageid_item["is_disambiguation_page"]:
+            return True
+        if args.exclude_sexual_pages and pageid_item["is_sexual_page"]:
+            return True
+        if args.exclude_violent_pages and pageid_item["is_violent_page"]:
+            return True
+
+        return False
+
+    if args.num_workers is None:
+        sent_splitter = SENTENCE_SPLITTER_CLASSES[args.sentence_splitter](args.mecab_option)
+    else:
+        sent_splitter = MultiprocessSentenceSplitter(
+            args.mecab_option,
+            num_workers=args.num_workers,
+            sentence_splitter_class=SENTENCE_SPLITTER_CLASSES[args.sentence_splitter],
+        )
+
+    with open_file(args.output_file, "wt", compression=args.compression, compression_level=args.compression_level,
+                   num_threads=args.compression_threads, default_compression="gzip") as fo:
         page_title = None
         is_page_processed = False
-        for line in tqdm(f):
-            paragraph_item = json.loads(line)
-            if paragraph_item["pageid"] in pageids_to_filter_out:
+
+        def write_paragraphs(titles, texts):
+            # The texts are split into sentences in a batch
+            nonlocal page_title, is_page_processed
+            for title, text, sentences in zip(titles, texts, sent_splitter.split_many(texts)):
+                if title != page_title:
+                    if is_page_processed:
+                        # insert a newline for separating pages
+                        print("", file=fo)
+
+                    page_title = title
+                    is_page_processed = False
+
+                for sentence in sentences:
+                    sentence = sentence.strip()
+                    if len(sentence) < args.min_sentence_length:
+                        continue
+                    if len(sentence) > args.max_sentence_length:
+                        continue
+
+                    assert not "\n" in text
+                    assert sentence != ""
+                    print(sentence, file=fo)
+                    is_page_processed = True
+
+        titles = []
+        texts = []
+        last_pageid = None
+        is_last_page_filtered_out = False
+        paragraph_items = iter_items(args.paragraphs_file, columns=PARAGRAPH_COLUMNS, num_threads=args.compression_threads)
+        for paragraph_item in tqdm(paragraph_items):
+            # The paragraphs of a page are consecutive, so the page is looked up only once
+            if paragraph_item["pageid"] != last_pageid:
+                last_pageid = paragraph_item["pageid"]
+                is_last_page_filtered_out = is_page_filtered_out(last_pageid)
+            if is_last_page_filtered_out:
                 continue
             if args.html_tags_to_use is not None and paragraph_item["html_tag"] not in args.html_tags_to_use:
                 continue
 
-            if paragraph_item["title"] != page_title:
-                if is_page_processed:
-                    # insert a newline for separating pages
-                    print("", file=fo)
-
-                page_title = paragraph_item["title"]
-                is_page_processed = False
+            titles.append(paragraph_item["title"])
+            texts.append(normalize_corpus_text(paragraph_item["text"]))
+            if len(texts) == args.batch_size:
+                write_paragraphs(titles, texts)
+                titles = []
+                texts = []
 
-            text = paragraph_item["text"]
-            text = preprocess_text(text)
-            for sentence in sent_splitter(text):
-                sentence = sentence.strip()
-                if len(sentence) < args.min_sentence_length:
-                    continue
-                if len(sentence) > args.max_sentence_length:
-                    continue
+        if len(texts) > 0:
+            write_paragraphs(titles, texts)
 
-                assert not "\n" in text
-                assert sentence != ""
-                print(sentence, file=fo)
-                is_page_processed = True
+    if args.num_workers is not None:
+        sent_splitter.close()
 
 
 if __name__ == "__main__":
@@ -94,13 +129,28 @@ if __name__ == "__main__":
     parser.add_argument("--paragraphs_file", type=str, required=True)
     parser.add_argument("--output_file", type=str, required=True)
     parser.add_argument("--mecab_option", type=str)
+    parser.add_argument("--sentence_splitter", choices=SENTENCE_SPLITTER_CLASSES.keys(), default="mecab",
+        help="rule_based splits the texts with rules and uses MeCab only for the texts ambiguous to the rules")
     parser.add_argument("--html_tags_to_use", nargs="+", type=str)
     parser.add_argument("--min_sentence_length", type=int, default=10)
     parser.add_argument("--max_sentence_length", type=int, default=1000)
-    parser.add_argument("--page_ids_file", type=str)
+    parser.add_argument("--page_ids_file", type=str,
+        help="Page IDs file or its binary version made by page_metadata.py")
     parser.add_argument("--min_inlinks", type=int)
     parser.add_argument("--exclude_disambiguation_pages", action="store_true")
     parser.add_argument("--exclude_sexual_pages", action="store_true")
     parser.add_argument("--exclude_violent_pages", action="store_true")
+    parser.add_argument("--num_workers", type=int,
+        help="Number of worker processes for splitting sentences. The main process is used if not specified")
+    parser.add_argument("--batch_size", type=int, default=1000,
+        help="Number of paragraphs to be split into sentences at a time")
+    parser.add_argument("--compression", choices=COMPRESSIONS,
+        help="Compression of the output file. Inferred from its extension (.gz or .zst) if not specified, "
+             "and gzip for the other extensions")
+    parser.add_argument("--compression_level", type=int,
+        help="Compression level of the output file (default: 9 for gzip, 3 for zstd)")
+    parser.add_argument("--compression_threads", type=int, default=1,
+        help="Number of threads compressing the output file. "
+             "For gzip, pigz is used to compress and decompress the files in separate processes if installed")
     args = parser.parse_args()
     main(args)
@@ -12,28 +12,45 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import argparse
-import gzip
-import json
-from typing import Callable, Optional
+from collections import deque
+from multiprocessing import Pool
+from typing import Callable, Iterable, List, Optional
 
 from tqdm import tqdm
 
-from sentence_splitters import MeCabSentenceSplitter
+from file_io import COMPRESSIONS, open_file
+from jsonl_io import dumps, write_jsonl
+from length_functions import CharLengthFunction, create_length_function
+from parquet_io import PARQUET_EXTENSION, PASSAGE_FIELDS, ROW_GROUP_SIZE, ParquetItemWriter, iter_items
+from sentence_splitters import SENTENCE_SPLITTER_CLASSES
 
 
-def generate_passages(
-    paragraphs_file: str,
+# The fields of the paragraphs used for making passages, which are the only columns read from the paragraphs file
+PARAGRAPH_COLUMNS = ("pageid", "revid", "title", "section", "text")
+
+
+def generate_passages_from_paragraph_items(
+    paragraph_items: Iterable[dict],
     passage_unit: str,
     passage_boundary: str,
     append_title_to_passage_text: bool,
+    title_passage_boundary: str,
     max_passage_length: int,
     as_long_as_possible: bool,
-    sentence_splitter: Optional[Callable] = None
+    sentence_splitter: Optional[Callable] = None,
+    first_passage_id: int = 1,
+    is_end_of_file: bool = True,
+    length_function: Optional[Callable] = None,
+    passage_overlap: int = 0,
 ):
     assert passage_unit in ("section", "paragraph", "sentence")
     assert passage_boundary in ("title", "section", "paragraph")
+    assert passage_overlap == 0 or as_long_as_possible
 
-    passage_id = 0
+    if length_function is None:
+        length_function = CharLengthFunction()
+
+    passage_id = first_passage_id - 1
     last_pageid = None
     last_revid = None
     last_title = None
@@ -42,79 +59,52 @@ def generate_passages(
     unit_texts = []
 
     def generate_passage_texts(unit_texts):
+        # The length of a passage is measured as the sum of the lengths of its units
+        unit_lengths = length_function.measure_many(unit_texts)
         if as_long_as_possible:
-            buffer_text = ""
-            for unit_text in unit_texts:
-                assert len(unit_text) <= max_passage_length
-                if len(buffer_text) + len(unit_text) > max_passage_length:
-                    yield buffer_text
-                    buffer_text = ""
+            buffer_texts = deque()
+            buffer_lengths = deque()
+            buffer_length = 0
+            num_new_units = 0
+            for unit_text, unit_length in zip(unit_texts, unit_lengths):
+                assert unit_length <= max_passage_length
+                if buffer_length + unit_length > max_passage_length:
+                    yield "".join(buffer_texts)
+                    num_new_units = 0
 
-                buffer_text += unit_text
+                    # keep the last units of the passage as the beginning of the next passage
+                    while len(buffer_texts) > passage_overlap or \
+                          (len(buffer_texts) > 0 and buffer_length + unit_length > max_passage_length):
+                        buffer_texts.popleft()
+                        buffer_length -= buffer_lengths.popleft()
+
+                buffer_texts.append(unit_text)
+                buffer_lengths.append(unit_length)
+                buffer_length += unit_length
+                num_new_units += 1
             else:
-                if len(buffer_text) > 0:
+                buffer_text = "".join(buffer_texts)
+                if num_new_units > 0 and len(buffer_text) > 0:
                     yield buffer_text
         else:
-            for unit_text in unit_texts:
-                assert len(unit_text) <= max_passage_length
+            for unit_text, unit_length in zip(unit_texts, unit_lengths):
+                assert unit_length <= max_passage_length
                 yield unit_text
 
-    with gzip.open(paragraphs_file, "rt") as f:
-        for line in f:
-            paragraph_item = json.loads(line)
-            pageid = paragraph_item["pageid"]
-            revid = paragraph_item["revid"]
-            title = paragraph_item["title"]
-            section = paragraph_item["section"]
-            paragraph_text = paragraph_item["text"]
-
-            if (title != last_title) or \
-               (passage_boundary == "paragraph") or \
-               (passage_boundary == "section" and section != last_section):
-                for passage_text in generate_passage_texts(unit_texts):
-                    passage_id += 1
-                    if append_title_to_passage_text:
-                        passage_text = last_title + args.title_passage_boundary + passage_text
-
-                    assert last_pageid is not None
-                    assert last_revid is not None
-                    assert last_title is not None
-                    assert last_section is not None
-                    output_item = {
-                        "id": passage_id,
-                        "pageid": last_pageid,
-                        "revid": last_revid,
-                        "title": last_title,
-                        "section": last_section,
-                        "text": passage_text,
-                    }
-                    yield output_item
-
-                unit_texts = []
-
-            if passage_unit == "section":
-                if section != last_section and len(section_text) > 0:
-                    if len(section_text) <= max_passage_length:
-                        unit_texts.append(section_text)
-
-                    section_text = ""
-
-                section_text += paragraph_text
-            elif passage_unit == "paragraph":
-                if len(paragraph_text) <= max_passage_length:
-                    unit_texts.append(paragraph_text)
-            elif passage_unit == "sentence":
-                unit_texts += [sent for sent in sentence_splitter(paragraph_text) if len(sent) <= max_passage_length]
-
-            last_pageid = pageid
-            last_revid = revid
-            last_title = title
-            last_section = section
-        else:
+    for paragraph_item in paragraph_items:
+        pageid = paragraph_item["pageid"]
+        revid = paragraph_item["revid"]
+        title = paragraph_item["title"]
+        section = paragraph_item["section"]
+        paragraph_text = paragraph_item["text"]
+
+        if (title != last_title) or \
+           (passage_boundary == "paragraph") or \
+           (passage_boundary == "section" and section != last_section):
             for passage_text in generate_passage_texts(unit_texts):
                 passage_id += 1
                 if append_title_to_passage_text:
-                    passage_text = last_title + passage_text
+                    passage_text = last_title + title_passage_boundary + passage_text
 
                 assert last_pageid is not None
                 assert last_revid is not None
@@ -130,22 +120,231 @@ def generate_passages(
                 }
                 yield output_item
 
+            unit_texts = []
 
-def main(args: argparse.Namespace):
-    sentence_splitter = MeCabSentenceSplitter(args.mecab_option)
-
-    with gzip.open(args.output_file, "wt") as fo:
-        passage_generator = generate_passages(
-            paragraphs_file=args.paragraphs_file,
-            passage_unit=args.passage_unit,
-            passage_boundary=args.passage_boundary,
-            append_title_to_passage_text=args.append_title_to_passage_text,
-            max_passage_length=args.max_passage_length,
-            as_long_as_possible=args.as_long_as_possible,
-            sentence_splitter=sentence_splitter
+        if passage_unit == "section":
+            if section != last_section and len(section_text) > 0:
+                if length_function(section_text) <= max_passage_length:
+                    unit_texts.append(section_text)
+
+                section_text = ""
+
+            section_text += paragraph_text
+        elif passage_unit == "paragraph":
+            if length_function(paragraph_text) <= max_passage_length:
+                unit_texts.append(paragraph_text)
+        elif passage_unit == "sentence":
+            unit_texts += [
+                sent for sent in sentence_splitter(paragraph_text) if length_function(sent) <= max_passage_length
+            ]
+
+        last_pageid = pageid
+        last_revid = revid
+        last_title = title
+        last_section = section
+    else:
+        for passage_text in generate_passage_texts(unit_texts):
+            passage_id += 1
+            if append_title_to_passage_text:
+                if is_end_of_file:
+                    passage_text = last_title + passage_text
+                else:
+                    # same as the passages flushed on a title change
+                    passage_text = last_title + title_passage_boundary + passage_text
+
+            assert last_pageid is not None
+            assert last_revid is not None
+            assert last_title is not None
+            assert last_section is not None
+            output_item = {
+                "id": passage_id,
+                "pageid": last_pageid,
+                "revid": last_revid,
+                "title": last_title,
+                "section": last_section,
+                "text": passage_text,
+            }
+            yield output_item
+
+
+def generate_passages(
+    paragraphs_file: str,
+    passage_unit: str,
+    passage_boundary: str,
+    append_title_to_passage_text: bool,
+    title_passage_boundary: str,
+    max_passage_length: int,
+    as_long_as_possible: bool,
+    sentence_splitter: Optional[Callable] = None,
+    first_passage_id: int = 1,
+    length_function: Optional[Callable] = None,
+    passage_overlap: int = 0,
+):
+    yield from generate_passages_from_paragraph_items(
+        iter_items(paragraphs_file, columns=PARAGRAPH_COLUMNS),
+        passage_unit=passage_unit,
+        passage_boundary=passage_boundary,
+        append_title_to_passage_text=append_title_to_passage_text,
+        title_passage_boundary=title_passage_boundary,
+        max_passage_length=max_passage_length,
+        as_long_as_possible=as_long_as_possible,
+        sentence_splitter=sentence_splitter,
+        first_passage_id=first_passage_id,
+        length_function=length_function,
+        passage_overlap=passage_overlap,
+    )
+
+
+def iter_paragraph_shards(paragraph_items: Iterable[dict], shard_size: int):
+    # The paragraphs are split into shards of about shard_size paragraphs only at title changes,
+    # since the passages of a page do not depend on the other pages
+    shard = []
+    last_title = None
+    for paragraph_item in paragraph_items:
+        title = paragraph_item["title"]
+        if len(shard) >= shard_size and title != last_title:
+            yield shard
+            shard = []
+
+        shard.append(paragraph_item)
+        last_title = title
+
+    if len(shard) > 0:
+        yield shard
+
+
+worker_sentence_splitter = None
+worker_length_function = None
+worker_args = None
+
+
+def init_worker(args: argparse.Namespace):
+    # Each worker process builds its own sentence splitter and length function only once
+    global worker_sentence_splitter, worker_length_function, worker_args
+    worker_sentence_splitter = SENTENCE_SPLITTER_CLASSES[args.sentence_splitter](args.mecab_option)
+    worker_length_function = create_length_function(args.length_unit, args.mecab_option, args.vocab_file)
+    worker_args = args
+
+
+def make_shard_passages(paragraph_items: List[dict], is_end_of_file: bool, as_items: bool = False) -> List:
+    # The passages of a shard are returned without their IDs, which are inserted by the main process
+    # once the number of the preceding passages is known.
+    # They are serialized as JSON lines unless as_items is True.
+    passage_generator = generate_passages_from_paragraph_items(
+        paragraph_items,
+        passage_unit=worker_args.passage_unit,
+        passage_boundary=worker_args.passage_boundary,
+        append_title_to_passage_text=worker_args.append_title_to_passage_text,
+        title_passage_boundary=worker_args.title_passage_boundary,
+        max_passage_length=worker_args.max_passage_length,
+        as_long_as_possible=worker_args.as_long_as_possible,
+        sentence_splitter=worker_sentence_splitter,
+        is_end_of_file=is_end_of_file,
+        length_function=worker_length_function,
+        passage_overlap=worker_args.passage_overlap,
+    )
+    passages = []
+    for passage_item in passage_generator:
+        del passage_item["id"]
+        passages.append(passage_item if as_items else dumps(passage_item))
+
+    return passages
+
+
+def open_passages_writer(args: argparse.Namespace):
+    # Returns a file object or a ParquetItemWriter for the output file
+    if args.output_file.endswith(PARQUET_EXTENSION):
+        return ParquetItemWriter(
+            args.output_file,
+            PASSAGE_FIELDS,
+            row_group_size=args.row_group_size,
+            compression=args.compression or "zstd",
+            compression_level=args.compression_level,
         )
-        for passage_item in tqdm(passage_generator):
-            print(json.dumps(passage_item, ensure_ascii=False), file=fo)
+
+    return open_file(
+        args.output_file,
+        "wt",
+        compression=args.compression,
+        compression_level=args.compression_level,
+        num_threads=args.compression_threads,
+        default_compression="gzip",
+    )
+
+
+def main(args: argparse.Namespace):
+    if args.passage_overlap > 0 and not args.as_long_as_possible:
+        raise ValueError("--passage_overlap is supported only with --as_long_as_possible")
+
+    if args.num_workers is None:
+        sentence_splitter = SENTENCE_SPLITTER_CLASSES[args.sentence_splitter](args.mecab_option)
+        length_function = create_length_function(args.length_unit, args.mecab_option, args.vocab_file)
+
+        with open_passages_writer(args) as fo:
+            passage_generator = generate_passages(
+                paragraphs_file=args.paragraphs_file,
+                passage_unit=args.passage_unit,
+                passage_boundary=args.passage_boundary,
+                append_title_to_passage_text=args.append_title_to_passage_text,
+                title_passage_boundary=args.title_passage_boundary,
+                max_passage_length=args.max_passage_length,
+                as_long_as_possible=args.as_long_as_possible,
+                sentence_splitter=sentence_splitter,
+                first_passage_id=args.first_passage_id,
+                length_function=length_function,
+                passage_overlap=args.passage_overlap,
+            )
+            if isinstance(fo, ParquetItemWriter):
+                fo.write_items(tqdm(passage_generator))
+            else:
+                write_jsonl(fo, tqdm(passage_generator))
+
+        return
+
+    if args.passage_unit == "section":
+        # The texts of sections are carried over across pages, so the pages cannot be processed independently
+        raise ValueError("--num_workers is not supported for --passage_unit section")
+
+    paragraph_items = iter_items(args.paragraphs_file, columns=PARAGRAPH_COLUMNS, num_threads=args.compression_threads)
+    with open_passages_writer(args) as fo, tqdm() as pbar, Pool(args.num_workers, init_worker, (args,)) as pool:
+        as_items = isinstance(fo, ParquetItemWriter)
+        passage_id = args.first_passage_id - 1
+
+        def write_passages(passages):
+            # Inserts the passage IDs continuing from the preceding shards.
+            # For the JSON lines, it is the same as json.dumps() of the passage items with the IDs as their first keys
+            nonlocal passage_id
+            if as_items:
+                fo.write_items(
+                    {"id": i, **passage_item} for i, passage_item in enumerate(passages, start=passage_id + 1)
+                )
+            else:
+                fo.writelines(
+                    '{"id": ' + str(i) + ", " + passage_line[1:] + "\n"
+                    for i, passage_line in enumerate(passages, start=passage_id + 1)
+                )
+
+            passage_id += len(passages)
+            pbar.update(len(passages))
+
+        # The shards are processed in parallel and their results are written in the input order.
+        # The number of shards in flight is bounded so that the input is not read faster than it is processed.
+        pending_results = deque()
+        last_shard = None
+        for shard in iter_paragraph_shards(paragraph_items, args.shard_size):
+            if last_shard is not None:
+                pending_results.append(pool.apply_async(make_shard_passages, (last_shard, False, as_items)))
+                if len(pending_results) >= args.num_workers * 2:
+                    write_passages(pending_results.popleft().get())
+
+            last_shard = shard
+
+        if last_shard is not None:
+            # The passages at the end of the file are made differently from the others
+            pending_results.append(pool.apply_async(make_shard_passages, (last_shard, True, as_items)))
+
+        while pending_results:
+            write_passages(pending_results.popleft().get())
 
 
 if __name__ == "__main__":
@@ -160,6 +359,36 @@ if __name__ == "__main__":
         help="It does not take page title lengths into account even if the "
              "--append_title_to_passage_text option is enabled")
     parser.add_argument("--as_long_as_possible", action="store_true")
+    parser.add_argument("--length_unit", choices=("char", "mecab_token", "subword"), default="char",
+        help="Unit of --max_passage_length. The length of a passage is the sum of the lengths of its sections, "
+             "paragraphs, or sentences")
+    parser.add_argument("--vocab_file", type=str,
+        help="Vocabulary file of the WordPiece tokenizer for --length_unit subword")
+    parser.add_argument("--passage_overlap", type=int, default=0,
+        help="Number of the last sentences (or other units) of a passage which are repeated at the beginning "
+             "of the next passage. Used with --as_long_as_possible")
     parser.add_argument("--mecab_option", type=str)
+    parser.add_argument("--sentence_splitter", choices=SENTENCE_SPLITTER_CLASSES.keys(), default="mecab",
+        help="rule_based splits the texts with rules and uses MeCab only for the texts ambiguous to the rules")
+    parser.add_argument("--first_passage_id", type=int, default=1,
+        help="Passage ID of the first passage. Set it to the last passage ID of the previous run plus one "
+             "when making passages of the updated pages for an incremental update")
+    parser.add_argument("--num_workers", type=int,
+        help="Number of worker processes. The paragraphs are processed in the main process if not specified. "
+             "Not supported for --passage_unit section")
+    parser.add_argument("--shard_size", type=int, default=1000,
+        help="Minimum number of paragraphs sent to a worker process at a time. "
+             "The paragraphs are divided only at the boundaries of pages")
+    parser.add_argument("--compression", choices=COMPRESSIONS,
+        help="Compression of the output file. Inferred from its extension (.gz or .zst) if not specified, "
+             "and gzip for the other extensions. "
+             "For a Parquet output file (.parquet), the compression codec of its pages (default: zstd)")
+    parser.add_argument("--compression_level", type=int,
+        help="Compression level of the output file (default: 9 for gzip, 3 for zstd)")
+    parser.add_argument("--compression_threads", type=int, default=1,
+        help="Number of threads compressing the output file. "
+             "For gzip, pigz is used to compress and decompress the files in separate processes if installed")
+    parser.add_argument("--row_group_size", type=int, default=ROW_GROUP_SIZE,
+        help="Number of passages in a row group of a Parquet output file (.parquet)")
     args = parser.parse_args()
     main(args)
@@ -0,0 +1,65 @@
+# Copyright 2022 Masatoshi Suzuki (@singletongue)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import argparse
+
+from logzero import logger
+from tqdm import tqdm
+
+from file_io import open_file
+from jsonl_io import loads
+
+
+def main(args):
+    logger.info("Loading Page IDs to replace or delete.")
+    page_ids = set()
+    for pageids_file in args.pageids_files:
+        with open(pageids_file) as f:
+            page_ids.update(loads(line)["pageid"] for line in tqdm(f))
+
+    logger.info("Loaded %d Page IDs.", len(page_ids))
+
+    n_removed = 0
+    n_added = 0
+    with open_file(args.base_file, "rt") as f, open_file(args.update_file, "rt") as fu, \
+         open_file(args.output_file, "wt") as fo:
+        logger.info("Copying the items of the base file.")
+        for line in tqdm(f):
+            item = loads(line)
+            if item["pageid"] in page_ids:
+                n_removed += 1
+                continue
+
+            print(line.rstrip("\n"), file=fo)
+
+        logger.info("Appending the items of the update file.")
+        for line in tqdm(fu):
+            print(line.rstrip("\n"), file=fo)
+            n_added += 1
+
+    logger.info("%d items have been removed from the base file.", n_removed)
+    logger.info("%d items have been added from the update file.", n_added)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base_file", type=str, required=True,
+        help="Items (page HTMLs, paragraphs or passages) of the previous run")
+    parser.add_argument("--update_file", type=str, required=True,
+        help="Items made from the updated pages only")
+    parser.add_argument("--pageids_files", nargs="+", type=str, required=True,
+        help="Page IDs files of the updated and deleted pages, "
+             "whose items in the base file are removed from the output file")
+    parser.add_argument("--output_file", type=str, required=True)
+    args = parser.parse_args()
+    main(args)
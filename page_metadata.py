@@ -0,0 +1,149 @@
+# Copyright 2022 Masatoshi Suzuki (@singletongue)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import argparse
+import mmap
+import struct
+from array import array
+from bisect import bisect_left
+
+from logzero import logger
+from tqdm import tqdm
+
+from jsonl_io import loads
+
+
+# The binary file consists of a header followed by the columns of the pages sorted by their page IDs:
+# pageids (int64), revids (int64), num_inlinks (int64), and flags (uint8, a bit for each of FLAG_NAMES).
+# The columns are memory-mapped, so the file is loaded instantly and shared through the page cache across processes.
+MAGIC = b"WUPMETA1"
+HEADER = struct.Struct("<8sQ")
+FLAG_NAMES = ("is_disambiguation_page", "is_sexual_page", "is_violent_page")
+# Stored for the pages without the number of inlinks, which is returned as None
+MISSING_NUM_INLINKS = -1
+
+
+class PageMetadata(object):
+    def __init__(self, pageids, revids, num_inlinks, flags):
+        self.pageids = pageids
+        self.revids = revids
+        self.num_inlinks = num_inlinks
+        self.flags = flags
+
+    @classmethod
+    def from_page_ids_file(cls, page_ids_file):
+        # Reads a page IDs file (one JSON per line) made by get_all_page_ids_from_cirrussearch.py.
+        # The missing attributes (e.g., in the files made by diff_page_ids.py) are filled with 0 or False,
+        # except for the number of inlinks, which is recorded as missing.
+        page_items = dict()
+        with open(page_ids_file) as f:
+            for line in tqdm(f):
+                page_item = loads(line)
+                page_items[page_item["pageid"]] = page_item
+
+        pageids = array("q", sorted(page_items.keys()))
+        revids = array("q")
+        num_inlinks = array("q")
+        flags = array("B")
+        for pageid in pageids:
+            page_item = page_items[pageid]
+            revids.append(page_item.get("revid", 0))
+            num_inlinks.append(page_item.get("num_inlinks", MISSING_NUM_INLINKS))
+            flags.append(sum(1 << i for i, flag_name in enumerate(FLAG_NAMES) if page_item.get(flag_name, False)))
+
+        return cls(pageids, revids, num_inlinks, flags)
+
+    @classmethod
+    def from_binary_file(cls, binary_file):
+        with open(binary_file, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, num_pages = HEADER.unpack_from(mm)
+        if magic != MAGIC:
+            raise ValueError(f"Not a page metadata file: {binary_file}")
+
+        buffer = memoryview(mm)
+        offset = HEADER.size
+        columns = []
+        for typecode in ("q", "q", "q", "B"):
+            size = num_pages * struct.calcsize(typecode)
+            columns.append(buffer[offset:offset + size].cast(typecode))
+            offset += size
+
+        return cls(*columns)
+
+    def save(self, binary_file):
+        with open(binary_file, "wb") as fo:
+            fo.write(HEADER.pack(MAGIC, len(self.pageids)))
+            for column in (self.pageids, self.revids, self.num_inlinks, self.flags):
+                fo.write(column.tobytes())
+
+    def index(self, pageid):
+        # Returns the position of the page in the columns, or -1 if the page is not found
+        i = bisect_left(self.pageids, pageid)
+        if i < len(self.pageids) and self.pageids[i] == pageid:
+            return i
+
+        return -1
+
+    def __len__(self):
+        return len(self.pageids)
+
+    def __contains__(self, pageid):
+        return self.index(pageid) != -1
+
+    def __getitem__(self, pageid):
+        page_item = self.get(pageid)
+        if page_item is None:
+            raise KeyError(pageid)
+
+        return page_item
+
+    def get(self, pageid, default=None):
+        i = self.index(pageid)
+        if i == -1:
+            return default
+
+        num_inlinks = self.num_inlinks[i] if self.num_inlinks[i] != MISSING_NUM_INLINKS else None
+        page_item = {"revid": self.revids[i], "num_inlinks": num_inlinks}
+        for j, flag_name in enumerate(FLAG_NAMES):
+            page_item[flag_name] = bool(self.flags[i] >> j & 1)
+
+        return page_item
+
+
+def load_page_metadata(file):
+    # Loads either a binary file made by this script or a page IDs file
+    with open(file, "rb") as f:
+        is_binary_file = f.read(len(MAGIC)) == MAGIC
+
+    if is_binary_file:
+        return PageMetadata.from_binary_file(file)
+    else:
+        return PageMetadata.from_page_ids_file(file)
+
+
+def main(args):
+    logger.info("Loading the page IDs file")
+    page_metadata = PageMetadata.from_page_ids_file(args.page_ids_file)
+
+    logger.info("Writing the metadata of %d pages", len(page_metadata))
+    page_metadata.save(args.output_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--page_ids_file", type=str, required=True)
+    parser.add_argument("--output_file", type=str, required=True)
+    args = parser.parse_args()
+    main(args)
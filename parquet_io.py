@@ -0,0 +1,127 @@
+# Copyright 2022 Masatoshi Suzuki (@singletongue)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+
+from file_io import open_file
+from jsonl_io import iter_jsonl, loads, make_decoder
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+# The fields of the corpora, paragraphs and passages and their types, which are also the features of the datasets
+# on the Hub
+CORPUS_FIELDS = {
+    "text": "string",
+}
+PARAGRAPH_FIELDS = {
+    "id": "string",
+    "pageid": "int64",
+    "revid": "int64",
+    "paragraph_index": "int64",
+    "title": "string",
+    "section": "string",
+    "text": "string",
+    "html_tag": "string",
+}
+PASSAGE_FIELDS = {
+    "id": "int64",
+    "pageid": "int64",
+    "revid": "int64",
+    "title": "string",
+    "section": "string",
+    "text": "string",
+}
+
+PARQUET_EXTENSION = ".parquet"
+PARQUET_MAGIC = b"PAR1"
+ROW_GROUP_SIZE = 100000
+READ_BATCH_SIZE = 10000
+
+
+def make_schema(fields):
+    if pa is None:
+        raise ImportError("pyarrow is required for reading or writing Parquet files: pip install pyarrow")
+
+    # The features are also stored in the metadata in the same way as the datasets library,
+    # so that the Parquet files are loaded with the features by load_dataset("parquet")
+    features = {name: {"dtype": dtype, "_type": "Value"} for name, dtype in fields.items()}
+    metadata = {"huggingface": json.dumps({"info": {"features": features}})}
+    return pa.schema([(name, pa.type_for_alias(dtype)) for name, dtype in fields.items()], metadata=metadata)
+
+
+def is_parquet_file(file):
+    with open(file, "rb") as f:
+        return f.read(len(PARQUET_MAGIC)) == PARQUET_MAGIC
+
+
+class ParquetItemWriter(object):
+    # Writes items to a Parquet file while streaming, buffering row_group_size items for each row group
+    def __init__(self, output_file, fields, row_group_size=ROW_GROUP_SIZE, compression="zstd", compression_level=None):
+        self.schema = make_schema(fields)
+        self.row_group_size = row_group_size
+        self.writer = pq.ParquetWriter(
+            output_file, self.schema, compression=compression, compression_level=compression_level
+        )
+        self.items = []
+
+    def write(self, item):
+        self.items.append(item)
+        if len(self.items) >= self.row_group_size:
+            self.flush()
+
+    def write_items(self, items):
+        for item in items:
+            self.write(item)
+
+    def flush(self):
+        if len(self.items) > 0:
+            table = pa.Table.from_pylist(self.items, schema=self.schema)
+            self.writer.write_table(table, row_group_size=self.row_group_size)
+            self.items = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def iter_parquet_items(input_file, columns=None, batch_size=READ_BATCH_SIZE):
+    if pq is None:
+        raise ImportError("pyarrow is required for reading or writing Parquet files: pip install pyarrow")
+
+    parquet_file = pq.ParquetFile(input_file)
+    for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        yield from batch.to_pylist()
+
+
+def iter_items(input_file, columns=None, num_threads=1):
+    # Reads the items from either a Parquet file or a JSON Lines file.
+    # If columns are given, only those columns are read from a Parquet file,
+    # and the other fields are skipped when decoding a JSON Lines file if msgspec is installed.
+    if is_parquet_file(input_file):
+        yield from iter_parquet_items(input_file, columns=columns)
+    else:
+        decode = make_decoder(columns) if columns is not None else loads
+        with open_file(input_file, "rb", num_threads=num_threads) as f:
+            yield from iter_jsonl(f, decode=decode)
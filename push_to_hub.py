@@ -1,9 +1,203 @@
 import argparse
+import os
+import shutil
+from collections import deque
+from multiprocessing import Pool
 
+import pyarrow.parquet as pq
+import yaml
 from datasets import Features, Value, load_dataset
+from huggingface_hub import CommitOperationAdd, CommitOperationDelete, HfApi, hf_hub_download
+from huggingface_hub.utils import EntryNotFoundError
+
+from file_io import open_file
+from jsonl_io import loads
+from parquet_io import (
+    CORPUS_FIELDS,
+    PARAGRAPH_FIELDS,
+    PASSAGE_FIELDS,
+    ROW_GROUP_SIZE,
+    ParquetItemWriter,
+    is_parquet_file,
+)
 
 
 DEFAULT_DATASET_REPO_ID = "singletongue/wikipedia-utils"
+DATASET_CARD_FILE_NAME = "README.md"
+
+
+def get_dataset_type_and_fields(config_name):
+    if config_name.startswith("corpus"):
+        return "text", CORPUS_FIELDS
+    elif config_name.startswith("paragraphs"):
+        return "json", PARAGRAPH_FIELDS
+    elif config_name.startswith("passages"):
+        return "json", PASSAGE_FIELDS
+    else:
+        raise ValueError("Invalid dataset config name is specified.")
+
+
+def iter_line_chunks(f, max_chunk_bytes):
+    chunk = []
+    num_bytes = 0
+    for line in f:
+        chunk.append(line)
+        num_bytes += len(line)
+        if num_bytes >= max_chunk_bytes:
+            yield chunk
+            chunk = []
+            num_bytes = 0
+
+    if len(chunk) > 0:
+        yield chunk
+
+
+def write_shard(lines, shard_file, dataset_type, fields, row_group_size):
+    # Each line of a text file is a row, in the same way as load_dataset("text")
+    if dataset_type == "text":
+        items = ({"text": line.rstrip(b"\r\n").decode("utf-8")} for line in lines)
+    else:
+        items = (loads(line) for line in lines)
+
+    with ParquetItemWriter(shard_file, fields, row_group_size=row_group_size) as writer:
+        writer.write_items(items)
+
+    return len(lines)
+
+
+def export_dataset(
+    dataset_file, export_dir, config_name, max_shard_bytes, num_workers=1, row_group_size=ROW_GROUP_SIZE
+):
+    # Converts the dataset file into Parquet shards of about max_shard_bytes bytes of the input lines each,
+    # which are written to <export_dir>/<config_name>/train-<index>-of-<number of shards>.parquet.
+    # The lines are read and split into shards in the main process, and the shards are written by worker processes.
+    # Returns the file names of the shards and the total number of rows.
+    dataset_type, fields = get_dataset_type_and_fields(config_name)
+    if is_parquet_file(dataset_file):
+        raise ValueError("The dataset file is already a Parquet file. Push it without --export_dir.")
+
+    config_dir = os.path.join(export_dir, config_name)
+    if os.path.exists(config_dir):
+        shutil.rmtree(config_dir)
+
+    os.makedirs(config_dir)
+
+    num_rows = 0
+    shard_num_rows = []
+    # The number of shards in flight is bounded, since each of them is held in memory
+    with open_file(dataset_file, "rb") as f, Pool(num_workers) as pool:
+        pending_results = deque()
+        for shard_index, lines in enumerate(iter_line_chunks(f, max_shard_bytes)):
+            print(f"writing shard {shard_index} ({len(lines)} rows)")
+            shard_file = os.path.join(config_dir, f"train-{shard_index:05d}.parquet")
+            pending_results.append(
+                pool.apply_async(write_shard, (lines, shard_file, dataset_type, fields, row_group_size))
+            )
+            num_rows += len(lines)
+            if len(pending_results) >= num_workers:
+                shard_num_rows.append(pending_results.popleft().get())
+
+        while pending_results:
+            shard_num_rows.append(pending_results.popleft().get())
+
+    # The shards are renamed once the number of shards is known, and their row counts are verified
+    num_shards = len(shard_num_rows)
+    shard_files = []
+    for shard_index, expected_num_rows in enumerate(shard_num_rows):
+        shard_file = os.path.join(config_dir, f"train-{shard_index:05d}-of-{num_shards:05d}.parquet")
+        os.rename(os.path.join(config_dir, f"train-{shard_index:05d}.parquet"), shard_file)
+        if pq.ParquetFile(shard_file).metadata.num_rows != expected_num_rows:
+            raise RuntimeError(f"The number of rows in {shard_file} does not match the input")
+
+        shard_files.append(shard_file)
+
+    if sum(shard_num_rows) != num_rows:
+        raise RuntimeError("The number of rows in the shards does not match the input")
+
+    update_dataset_card_file(os.path.join(export_dir, DATASET_CARD_FILE_NAME), config_name, fields, num_rows)
+    return shard_files, num_rows
+
+
+def update_dataset_card(card_text, config_name, fields, num_rows):
+    # Adds or replaces the config in the YAML metadata of a dataset card,
+    # so that the config is loaded from the Parquet shards with the features
+    metadata = {}
+    body = card_text
+    if card_text.startswith("---\n"):
+        metadata_text, _, body = card_text[len("---\n"):].partition("\n---\n")
+        metadata = yaml.safe_load(metadata_text) or {}
+
+    configs = [config for config in metadata.get("configs", []) if config["config_name"] != config_name]
+    configs.append(
+        {"config_name": config_name, "data_files": [{"split": "train", "path": f"{config_name}/train-*"}]}
+    )
+    metadata["configs"] = sorted(configs, key=lambda config: config["config_name"])
+
+    dataset_infos = metadata.get("dataset_info", [])
+    if isinstance(dataset_infos, dict):
+        dataset_infos = [dataset_infos]
+
+    dataset_infos = [info for info in dataset_infos if info.get("config_name") != config_name]
+    dataset_infos.append(
+        {
+            "config_name": config_name,
+            "features": [{"name": name, "dtype": dtype} for name, dtype in fields.items()],
+            "splits": [{"name": "train", "num_examples": num_rows}],
+        }
+    )
+    metadata["dataset_info"] = sorted(dataset_infos, key=lambda info: info.get("config_name", ""))
+
+    metadata_text = yaml.safe_dump(metadata, allow_unicode=True, sort_keys=False)
+    return "---\n" + metadata_text + "---\n" + body
+
+
+def update_dataset_card_file(card_file, config_name, fields, num_rows):
+    card_text = ""
+    if os.path.exists(card_file):
+        with open(card_file) as f:
+            card_text = f.read()
+
+    with open(card_file, "w") as fo:
+        fo.write(update_dataset_card(card_text, config_name, fields, num_rows))
+
+
+def upload_to_local_dir(shard_files, config_name, fields, num_rows, target_dir):
+    # Places the shards in a local directory in the same layout as the dataset repository,
+    # replacing the files of the config, e.g., for testing or for pushing the repository with git
+    config_dir = os.path.join(target_dir, config_name)
+    if os.path.exists(config_dir):
+        shutil.rmtree(config_dir)
+
+    os.makedirs(config_dir)
+    for shard_file in shard_files:
+        shutil.copy(shard_file, config_dir)
+
+    update_dataset_card_file(os.path.join(target_dir, DATASET_CARD_FILE_NAME), config_name, fields, num_rows)
+
+
+def upload_to_hub(shard_files, config_name, fields, num_rows, repo_id):
+    # Replaces the files of the config and updates the dataset card in a single commit
+    api = HfApi()
+    api.create_repo(repo_id, repo_type="dataset", exist_ok=True)
+    try:
+        with open(hf_hub_download(repo_id, DATASET_CARD_FILE_NAME, repo_type="dataset")) as f:
+            card_text = f.read()
+    except EntryNotFoundError:
+        card_text = ""
+
+    shard_paths = [f"{config_name}/{os.path.basename(shard_file)}" for shard_file in shard_files]
+    operations = [
+        CommitOperationDelete(path_in_repo=path)
+        for path in api.list_repo_files(repo_id, repo_type="dataset")
+        if path.startswith(f"{config_name}/") and path not in shard_paths
+    ]
+    operations += [
+        CommitOperationAdd(path_in_repo=path, path_or_fileobj=shard_file)
+        for path, shard_file in zip(shard_paths, shard_files)
+    ]
+    card_text = update_dataset_card(card_text, config_name, fields, num_rows)
+    operations.append(CommitOperationAdd(path_in_repo=DATASET_CARD_FILE_NAME, path_or_fileobj=card_text.encode()))
+    api.create_commit(repo_id, operations, commit_message=f"Upload {config_name}", repo_type="dataset")
 
 
 def main():
@@ -11,45 +205,62 @@ def main():
     parser.add_argument("--dataset_file", type=str, required=True)
     parser.add_argument("--config_name", type=str, required=True)
     parser.add_argument("--dataset_repo_id", type=str, default=DEFAULT_DATASET_REPO_ID)
+    parser.add_argument("--export_dir", type=str,
+        help="Convert the dataset file into Parquet shards in this directory without load_dataset(), "
+             "and upload them as they are")
+    parser.add_argument("--max_shard_bytes", type=int, default=256 * 1024 * 1024,
+        help="Maximum size of the input lines in a shard. Up to --num_workers shards are held in memory at a time")
+    parser.add_argument("--num_workers", type=int, default=1,
+        help="Number of worker processes writing the shards")
+    parser.add_argument("--row_group_size", type=int, default=ROW_GROUP_SIZE,
+        help="Number of rows in a row group of the shards")
+    parser.add_argument("--local_target_dir", type=str,
+        help="Place the shards in this directory in the layout of the dataset repository "
+             "instead of uploading them to the Hub")
+    parser.add_argument("--export_only", action="store_true",
+        help="Only convert the dataset file into the shards in --export_dir")
     args = parser.parse_args()
 
-    if args.config_name.startswith("corpus"):
-        dataset_type = "text"
-        features = Features({"text": Value("string")})
-    elif args.config_name.startswith("paragraphs"):
-        dataset_type = "json"
-        features = Features(
-            {
-                "id": Value("string"),
-                "pageid": Value("int64"),
-                "revid": Value("int64"),
-                "paragraph_index": Value("int64"),
-                "title": Value("string"),
-                "section": Value("string"),
-                "text": Value("string"),
-                "html_tag": Value("string"),
-            }
-        )
-    elif args.config_name.startswith("passages"):
-        dataset_type = "json"
-        features = Features(
-            {
-                "id": Value("int64"),
-                "pageid": Value("int64"),
-                "revid": Value("int64"),
-                "title": Value("string"),
-                "section": Value("string"),
-                "text": Value("string"),
-            }
-        )
-    else:
-        raise ValueError("Invalid dataset config name is specified.")
+    dataset_type, fields = get_dataset_type_and_fields(args.config_name)
+
+    if args.export_dir is None:
+        if dataset_type == "json" and is_parquet_file(args.dataset_file):
+            # The columns are read as they are in the Parquet file, without parsing JSON lines
+            dataset_type = "parquet"
 
-    print("loading the dataset")
-    dataset = load_dataset(dataset_type, data_files={"train": str(args.dataset_file)}, features=features)
+        features = Features({name: Value(dtype) for name, dtype in fields.items()})
 
-    print(f"pushing the dataset to {args.dataset_repo_id} with config name {args.config_name}")
-    dataset.push_to_hub(args.dataset_repo_id, config_name=args.config_name)
+        print("loading the dataset")
+        dataset = load_dataset(dataset_type, data_files={"train": str(args.dataset_file)}, features=features)
+
+        print(f"pushing the dataset to {args.dataset_repo_id} with config name {args.config_name}")
+        dataset.push_to_hub(args.dataset_repo_id, config_name=args.config_name)
+        return
+
+    if args.local_target_dir is not None:
+        # the shards in the export directory would be removed before being copied
+        if os.path.abspath(args.local_target_dir) == os.path.abspath(args.export_dir):
+            raise ValueError("--local_target_dir should be different from --export_dir.")
+
+    print(f"exporting the dataset to {args.export_dir}")
+    shard_files, num_rows = export_dataset(
+        args.dataset_file,
+        args.export_dir,
+        args.config_name,
+        args.max_shard_bytes,
+        num_workers=args.num_workers,
+        row_group_size=args.row_group_size,
+    )
+    print(f"exported {num_rows} rows in {len(shard_files)} shards")
+
+    if args.export_only:
+        return
+    elif args.local_target_dir is not None:
+        print(f"copying the shards to {args.local_target_dir} with config name {args.config_name}")
+        upload_to_local_dir(shard_files, args.config_name, fields, num_rows, args.local_target_dir)
+    else:
+        print(f"uploading the shards to {args.dataset_repo_id} with config name {args.config_name}")
+        upload_to_hub(shard_files, args.config_name, fields, num_rows, args.dataset_repo_id)
 
 if __name__ == "__main__":
     main()
@@ -12,33 +12,186 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import os
+import re
+import unicodedata
+from multiprocessing import Pool
+
+
+def create_mecab_tagger(mecab_option=None):
+    import fugashi
+    if mecab_option is None:
+        import unidic_lite
+        dic_dir = unidic_lite.DICDIR
+        mecabrc = os.path.join(dic_dir, "mecabrc")
+        mecab_option = "-d {} -r {}".format(dic_dir, mecabrc)
+
+    return fugashi.GenericTagger(mecab_option)
 
 
 class MeCabSentenceSplitter(object):
     def __init__(self, mecab_option=None):
-        import fugashi
-        if mecab_option is None:
-            import unidic_lite
-            dic_dir = unidic_lite.DICDIR
-            mecabrc = os.path.join(dic_dir, "mecabrc")
-            mecab_option = "-d {} -r {}".format(dic_dir, mecabrc)
-
-        self.mecab = fugashi.GenericTagger(mecab_option)
+        self.mecab = create_mecab_tagger(mecab_option)
 
     def __call__(self, text):
         sentences = []
         start = 0
         end = 0
-        for line in self.mecab.parse(text).split("\n"):
-            if line == "EOS":
-                if len(text[start:]) > 0:
-                    sentences.append(text[start:])
-                break
-
-            token, token_info = line.split("\t", maxsplit=1)
-            end = text.index(token, end) + len(token)
-            if "記号" in token_info and "句点" in token_info:
+        for node in self.mecab(text):
+            # The offsets are tracked with the lengths of the white spaces and the surfaces of the nodes
+            surface = node.surface
+            end += len(node.white_space)
+            if not text.startswith(surface, end):
+                end = text.index(surface, end)
+
+            end += len(surface)
+            feature = node.feature_raw
+            if "句点" not in feature:
+                continue
+
+            # Only the first two fields of the feature (the part-of-speech tags) are checked
+            features = feature.split(",", 2)
+            if len(features) > 1 and "記号" in features[0] and features[1] == "句点":
                 sentences.append(text[start:end])
                 start = end
 
+        if len(text[start:]) > 0:
+            sentences.append(text[start:])
+
+        return sentences
+
+    def split_many(self, texts):
+        return [self(text) for text in texts]
+
+
+class RuleBasedSentenceSplitter(object):
+    # Splits a text after each of the sentence-final punctuation marks outside brackets and quotes.
+    # MeCab is used only for the texts where the rules are ambiguous.
+    SENTENCE_END_CHARS = "。！？!?"
+    OPENING_BRACKETS = "「『（(［[【〈《〔｛{“"
+    CLOSING_BRACKETS = "」』）)］]】〉》〕｝}”"
+    BRACKETS = OPENING_BRACKETS + CLOSING_BRACKETS
+
+    # Periods in ASCII or full-width alphabets can be parts of numbers or abbreviations, and are left to MeCab
+    AMBIGUOUS_PATTERN = re.compile(r"[.．]")
+    SCANNER_PATTERN = re.compile(
+        "[{}]+|[{}{}]".format(
+            re.escape(SENTENCE_END_CHARS), re.escape(OPENING_BRACKETS), re.escape(CLOSING_BRACKETS)
+        )
+    )
+
+    def __init__(self, mecab_option=None):
+        self.mecab_sentence_splitter = MeCabSentenceSplitter(mecab_option)
+
+    def is_symbol(self, char):
+        # Symbols include the control, format and separator characters other than the ASCII space,
+        # and the iteration, closing and zero marks, which MeCab can group with the adjacent symbols
+        return (unicodedata.category(char)[0] in "PSCZ" and char != " ") or char in "々〆〇"
+
+    def is_next_to_symbol(self, text, start, end):
+        # The brackets next to a punctuation mark are skipped, since MeCab splits them from the punctuation marks
+        # unless they are next to symbols
+        before = start - 1
+        while before >= 0 and text[before] in self.BRACKETS:
+            before -= 1
+        after = end
+        while after < len(text) and text[after] in self.BRACKETS:
+            after += 1
+
+        return (before >= 0 and self.is_symbol(text[before])) or (after < len(text) and self.is_symbol(text[after]))
+
+    def split_by_rules(self, text):
+        # Returns None if the text should be split by MeCab
+        if self.AMBIGUOUS_PATTERN.search(text):
+            return None
+
+        sentences = []
+        start = 0
+        # the closing brackets expected for the open brackets
+        expected_closing_brackets = []
+        for match in self.SCANNER_PATTERN.finditer(text):
+            token = match.group()
+            if token in self.OPENING_BRACKETS:
+                expected_closing_brackets.append(self.CLOSING_BRACKETS[self.OPENING_BRACKETS.index(token)])
+            elif token in self.CLOSING_BRACKETS:
+                # unbalanced or mismatched brackets
+                if len(expected_closing_brackets) == 0 or expected_closing_brackets.pop() != token:
+                    return None
+            elif len(expected_closing_brackets) > 0 or len(token) > 1:
+                # punctuation marks inside brackets or consecutive ones (e.g., "？！")
+                return None
+            elif self.is_next_to_symbol(text, match.start(), match.end()):
+                # MeCab makes a punctuation mark a part of the adjacent symbols (e.g., "モーニング娘。'14")
+                return None
+            else:
+                sentences.append(text[start:match.end()])
+                start = match.end()
+
+        if len(expected_closing_brackets) > 0:
+            return None
+
+        if len(text[start:]) > 0:
+            sentences.append(text[start:])
+
         return sentences
+
+    def __call__(self, text):
+        sentences = self.split_by_rules(text)
+        if sentences is None:
+            sentences = self.mecab_sentence_splitter(text)
+
+        return sentences
+
+    def split_many(self, texts):
+        return [self(text) for text in texts]
+
+
+SENTENCE_SPLITTER_CLASSES = {
+    "mecab": MeCabSentenceSplitter,
+    "rule_based": RuleBasedSentenceSplitter,
+}
+
+
+worker_sentence_splitter = None
+
+
+def init_sentence_splitter_worker(sentence_splitter_class, mecab_option):
+    # Each worker process loads the dictionary only once
+    global worker_sentence_splitter
+    worker_sentence_splitter = sentence_splitter_class(mecab_option)
+
+
+def split_texts_in_worker(texts):
+    return worker_sentence_splitter.split_many(texts)
+
+
+class MultiprocessSentenceSplitter(object):
+    # Splits texts with a pool of worker processes, each of which holds its own sentence splitter.
+    # The texts should be given in batches with split_many() so that the workers are kept busy.
+    def __init__(
+        self, mecab_option=None, num_workers=None, sentence_splitter_class=MeCabSentenceSplitter, chunk_size=100
+    ):
+        self.chunk_size = chunk_size
+        self.pool = Pool(num_workers, init_sentence_splitter_worker, (sentence_splitter_class, mecab_option))
+
+    def __call__(self, text):
+        return self.split_many([text])[0]
+
+    def split_many(self, texts):
+        chunks = [texts[i:i + self.chunk_size] for i in range(0, len(texts), self.chunk_size)]
+
+        # The sentences are returned in the order of the texts
+        sentences_list = []
+        for chunk_sentences_list in self.pool.imap(split_texts_in_worker, chunks):
+            sentences_list.extend(chunk_sentences_list)
+
+        return sentences_list
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
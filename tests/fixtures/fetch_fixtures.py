@@ -0,0 +1,61 @@
+# Copyright 2022 Masatoshi Suzuki (@singletongue)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import argparse
+import os
+from urllib.parse import quote
+
+import requests
+
+
+# Pages with infoboxes, references, math, lists, tables, pre blocks and titles ending with a symbol
+FIXTURE_PAGES = {
+    "tokyo": "東京都",
+    "mount_fuji": "富士山",
+    "ampersand": "アンパサンド",
+    "pythagorean_theorem": "ピタゴラスの定理",
+    "python": "Python",
+    "morning_musume": "モーニング娘。",
+    "prefectures": "都道府県",
+}
+ENDPOINTS = {
+    "parsoid": "page/html",
+    "mobile_html": "page/mobile-html",
+}
+
+
+def main(args):
+    # Saves the Parsoid and mobile-html pages as <endpoint>_<name>.html in the fixtures directory
+    headers = {"User-Agent": args.user_agent}
+    for name, title in FIXTURE_PAGES.items():
+        for endpoint_name, endpoint in ENDPOINTS.items():
+            url = "https://{}.wikipedia.org/api/rest_v1/{}/{}".format(
+                args.language, endpoint, quote(title.replace(" ", "_"), safe="")
+            )
+            response = requests.get(url, headers=headers, timeout=60)
+            response.raise_for_status()
+
+            output_file = os.path.join(args.output_dir, f"{endpoint_name}_{name}.html")
+            with open(output_file, "w") as fo:
+                fo.write(response.text)
+
+            print(f"saved {url} to {output_file}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch the Wikipedia pages used as the test fixtures")
+    parser.add_argument("--user_agent", type=str, required=True)
+    parser.add_argument("--language", type=str, default="ja")
+    parser.add_argument("--output_dir", type=str, default=os.path.dirname(os.path.abspath(__file__)))
+    args = parser.parse_args()
+    main(args)
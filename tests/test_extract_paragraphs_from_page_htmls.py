@@ -0,0 +1,54 @@
+import os
+
+import pytest
+from bs4 import BeautifulSoup
+from lxml import etree
+
+from extract_paragraphs_from_page_htmls import (
+    DEFAULT_INNER_TAGS_TO_REMOVE,
+    DEFAULT_TAGS_TO_EXTRACT,
+    DEFAULT_TAGS_TO_REMOVE,
+    extract_paragraphs_from_html,
+    extract_paragraphs_from_html_lxml,
+    get_element_text,
+)
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+FIXTURE_FILES = sorted(file_name for file_name in os.listdir(FIXTURES_DIR) if file_name.endswith(".html"))
+
+# (tags_to_extract, tags_to_remove, inner_tags_to_remove)
+TAG_LISTS = [
+    (DEFAULT_TAGS_TO_EXTRACT, DEFAULT_TAGS_TO_REMOVE, DEFAULT_INNER_TAGS_TO_REMOVE),
+    (["p", "li", "dd", "pre", "h3", "figcaption"], ["table", "style", "figure"], ["sup", "math", "span"]),
+    # the extracted tags are nested, and the strings in style, script and pre tags are not removed
+    (["p", "div", "li", "pre", "section"], [], []),
+]
+
+
+def read_fixture(fixture_file):
+    with open(os.path.join(FIXTURES_DIR, fixture_file)) as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("fixture_file", FIXTURE_FILES)
+@pytest.mark.parametrize("tags_to_extract, tags_to_remove, inner_tags_to_remove", TAG_LISTS)
+def test_lxml_engine_is_equivalent_to_bs4(fixture_file, tags_to_extract, tags_to_remove, inner_tags_to_remove):
+    html = read_fixture(fixture_file)
+    tag_lists = (tags_to_extract, tags_to_remove, inner_tags_to_remove)
+
+    expected = list(extract_paragraphs_from_html(html, *tag_lists))
+    assert len(expected) > 0
+    assert list(extract_paragraphs_from_html_lxml(html, *tag_lists)) == expected
+
+
+@pytest.mark.parametrize("fixture_file", FIXTURE_FILES)
+def test_element_text_is_equivalent_to_bs4(fixture_file):
+    # The texts are compared before the normalization, which would hide the differences in whitespaces
+    html = read_fixture(fixture_file)
+    tags = BeautifulSoup(html, features="lxml").find_all(True)
+    elements = [element for element in etree.HTML(html).iter() if isinstance(element.tag, str)]
+
+    assert [element.tag for element in elements] == [tag.name for tag in tags]
+    for element, tag in zip(elements, tags):
+        assert get_element_text(element) == tag.text
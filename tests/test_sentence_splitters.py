@@ -0,0 +1,62 @@
+import random
+
+import pytest
+
+pytest.importorskip("fugashi")
+pytest.importorskip("unidic_lite")
+
+from sentence_splitters import MeCabSentenceSplitter, RuleBasedSentenceSplitter
+
+
+# Punctuation marks next to symbols, brackets and spaces, which MeCab does not always split after
+TEXTS = [
+    "モーニング娘。'14のメンバー。",
+    "遊戯王!-ゼアル-の放送。",
+    "東京都は日本の首都である。人口は約1400万人である。",
+    "「東京」は都である。（略称）東京都は首都である。",
+    "本当か？ 本当だ！ そうか。",
+    "『ガンダム』の続編か？「新作」だ！",
+    "人々。東京〆切。〇〇！",
+    "はい。・いいえ。",
+    "ゼアル。（略）〕です。",
+]
+
+WORDS = ["東京", "モーニング娘", "遊戯王", "ゼアル", "放送", "の", "は", "メンバー", "14", "2014年", "abc", "です"]
+MARKS = list("。！？!?")
+SYMBOLS = list("'-;・:/~～+*#&%$@=_|^<>\"“”「」（）()、，,…‥ー♪★☆→※々〆〇 　")
+
+
+def make_random_texts(num_texts, seed=0):
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(num_texts):
+        parts = [rng.choice(rng.choice([WORDS, WORDS, MARKS, SYMBOLS])) for _ in range(rng.randint(2, 10))]
+        texts.append("".join(parts))
+
+    return texts
+
+
+@pytest.fixture(scope="module")
+def mecab_sentence_splitter():
+    return MeCabSentenceSplitter()
+
+
+@pytest.fixture(scope="module")
+def rule_based_sentence_splitter():
+    return RuleBasedSentenceSplitter()
+
+
+@pytest.mark.parametrize("text", TEXTS)
+def test_rule_based_splitter_agrees_with_mecab(text, mecab_sentence_splitter, rule_based_sentence_splitter):
+    assert rule_based_sentence_splitter(text) == mecab_sentence_splitter(text)
+
+
+def test_rule_based_splitter_agrees_with_mecab_on_random_texts(mecab_sentence_splitter, rule_based_sentence_splitter):
+    texts = make_random_texts(3000)
+    rule_based_sentences_list = [rule_based_sentence_splitter.split_by_rules(text) for text in texts]
+    # the rules should still be used for a good part of the texts
+    assert sum(sentences is not None for sentences in rule_based_sentences_list) > len(texts) // 4
+
+    for text, sentences in zip(texts, rule_based_sentences_list):
+        if sentences is not None:
+            assert sentences == mecab_sentence_splitter(text), text
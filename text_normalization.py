@@ -0,0 +1,61 @@
+# Copyright 2022 Masatoshi Suzuki (@singletongue)
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import unicodedata
+
+
+class NonPrintableCharsTable(dict):
+    # A translation table for str.translate() which deletes non-printable characters.
+    # The entries are computed on the first lookup of each character and cached in the dict,
+    # so that the subsequent lookups are done without calling Python code.
+    def __missing__(self, codepoint):
+        value = codepoint if chr(codepoint).isprintable() else None
+        self[codepoint] = value
+        return value
+
+
+NON_PRINTABLE_CHARS_TABLE = NonPrintableCharsTable()
+
+
+def normalize_nfkc(text):
+    if unicodedata.is_normalized("NFKC", text):
+        return text
+
+    return unicodedata.normalize("NFKC", text)
+
+
+def remove_non_printable_chars(text):
+    if text.isprintable():
+        return text
+
+    return text.translate(NON_PRINTABLE_CHARS_TABLE)
+
+
+def normalize_whitespaces(text):
+    # Replaces every sequence of whitespaces with a single space and strips the text
+    return " ".join(text.split())
+
+
+def normalize_paragraph_text(text):
+    text = normalize_nfkc(text)
+    text = normalize_whitespaces(text)
+    text = remove_non_printable_chars(text)
+    text = text.strip()
+    return text
+
+
+def normalize_corpus_text(text):
+    text = normalize_nfkc(text)
+    text = remove_non_printable_chars(text)
+    text = normalize_whitespaces(text)
+    return text